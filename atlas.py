@@ -0,0 +1,183 @@
+"""Texture atlas that packs many small rendered images into a few textures.
+"""
+# Copyright 2013 Aaron Graham-Horowitz
+#
+# This file is part of Escape from Wikipedia.
+#
+# Escape from Wikipedia is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or any later version.
+#
+# Escape from Wikipedia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import glutils
+from constants import *
+
+
+class AtlasPage:
+    """One large texture, filled from the bottom up with shelves of images.
+
+    Each shelf is a row as tall as the first image placed on it; images are
+    placed left to right until the shelf is full. A released image leaves a
+    free slot on its shelf, which a later image of about the same height can
+    take. Until then the unused image stays in the slot, in case it is wanted
+    again.
+    """
+    def __init__(self):
+        self.tex_id = glutils.getBlankTexture(ATLAS_SIZE, ATLAS_SIZE)
+        self.shelves = []     # [y, height, next free x, free slots, widest
+                              # free slot, or wider]
+        self.widest = ATLAS_SIZE    # No room on any shelf is wider
+        self.next_y = 0
+        self.live = 0         # Number of entries still in use
+        self.keys = set()     # Keys of the entries stored here
+
+    def place(self, w, h):
+        """Reserve a `w' by `h' region, or return None if there is no room.
+
+        Return (shelf, slot, evicted). The region is at x-coordinate
+        `slot[0]' on `shelf', and `slot' is [x, width, key], to be given
+        back with `free'. `evicted' is the key of an unused image whose slot
+        was taken, or None.
+        """
+        w += ATLAS_PADDING
+        h += ATLAS_PADDING
+        new_shelf = self.next_y + h <= ATLAS_SIZE and w <= ATLAS_SIZE
+        if w > self.widest and not new_shelf:
+            return None
+        widest = 0
+        for shelf in self.shelves:
+            y, height, x, free, shelf_widest = shelf
+            # Don't waste a tall shelf on a much shorter image
+            if h <= height and 2 * h > height:
+                if shelf_widest >= w:
+                    for slot in free:
+                        if slot[1] >= w:
+                            free.remove(slot)
+                            if slot[1] - w >= height:   # Keep the rest free
+                                free.append([slot[0] + w, slot[1] - w, None])
+                            return shelf, [slot[0], w, None], slot[2]
+                    shelf[4] = shelf_widest = max([s[1] for s in free] or [0])
+                if x + w <= ATLAS_SIZE:
+                    shelf[2] += w
+                    return shelf, [x, w, None], None
+            widest = max(widest, shelf_widest, ATLAS_SIZE - x)
+        self.widest = widest
+        if not new_shelf:
+            return None
+        self.shelves.append([self.next_y, h, w, [], 0])
+        self.next_y += h
+        return self.shelves[-1], [0, w, None], None
+
+    def free(self, shelf, slot, key):
+        """Let another image take `slot', which still holds unused `key'."""
+        slot[2] = key
+        shelf[3].append(slot)
+        shelf[4] = max(shelf[4], slot[1])
+        self.widest = max(self.widest, slot[1])
+
+    def keep(self, shelf, slot):
+        """Take back `slot' after `free', as its image is wanted again."""
+        shelf[3].remove(slot)
+
+
+class TextureAtlas:
+    """Shared store of rendered images, keyed by whatever identifies them.
+
+    Identical keys share a single region, so each distinct image is rendered
+    and uploaded only once. Images too large for a page get their own texture.
+    Entries are reference counted; an unused entry is kept until its space is
+    needed for another image, and a page is freed once none of its entries
+    are in use.
+    """
+    def __init__(self):
+        self.pages = []
+        # key -> [tex_id, tex_shape, (w, h), page, refs, shelf, slot]
+        self.entries = {}
+
+    def lookup(self, key):
+        """Return (tex_id, tex_shape, size) for `key', or None if not stored.
+
+        A successful lookup takes a reference to the entry.
+        """
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        entry[4] += 1
+        if entry[3] is not None and entry[4] == 1:
+            entry[3].live += 1
+            entry[3].keep(entry[5], entry[6])
+        return entry[0], entry[1], entry[2]
+
+    def add(self, key, image):
+        """Upload pygame surface `image' under `key' and return its entry.
+
+        The caller owns one reference to the new entry.
+        """
+        w, h = image.get_size()
+        page, placed = self.place(w, h)
+        if placed is None:
+            entry = [glutils.getTexture(image), (0, 1, 1, 0), (w, h), None, 1,
+                     None, None]
+        else:
+            shelf, slot, evicted = placed
+            if evicted is not None:
+                del self.entries[evicted]
+                page.keys.remove(evicted)
+            x, y = slot[0], shelf[0]
+            glutils.subTexture(page.tex_id, x, y, image)
+            s = float(ATLAS_SIZE)
+            entry = [page.tex_id, (x / s, (y + h) / s, (x + w) / s, y / s),
+                     (w, h), page, 1, shelf, slot]
+            page.live += 1
+            page.keys.add(key)
+        self.entries[key] = entry
+        return entry[0], entry[1], entry[2]
+
+    def place(self, w, h):
+        """Find room for a `w' by `h' image, on a new page if need be.
+
+        Return (page, (shelf, slot, evicted)), or (None, None) if the image
+        is too large for a page.
+        """
+        for page in self.pages:
+            placed = page.place(w, h)
+            if placed is not None:
+                return page, placed
+        if w + ATLAS_PADDING > ATLAS_SIZE or h + ATLAS_PADDING > ATLAS_SIZE:
+            return None, None
+        page = AtlasPage()
+        self.pages.append(page)
+        return page, page.place(w, h)
+
+    def release(self, key):
+        """Drop a reference to the entry for `key'."""
+        entry = self.entries[key]
+        entry[4] -= 1
+        if entry[4] > 0:
+            return
+        page = entry[3]
+        if page is None:
+            del self.entries[key]
+            glutils.releaseTexture(entry[0])
+            return
+        # Unused entries stay until their space is taken or their page
+        # empties, in case they are wanted again.
+        page.live -= 1
+        if page.live == 0:
+            self.freePage(page)
+        else:
+            page.free(entry[5], entry[6], key)
+
+    def freePage(self, page):
+        """Forget every entry on an empty page, then free its texture."""
+        for key in page.keys:
+            del self.entries[key]
+        self.pages.remove(page)
+        glutils.releaseTexture(page.tex_id)
@@ -0,0 +1,93 @@
+"""Batches of textured quads, drawn with a handful of calls.
+"""
+# Copyright 2013 Aaron Graham-Horowitz
+#
+# This file is part of Escape from Wikipedia.
+#
+# Escape from Wikipedia is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or any later version.
+#
+# Escape from Wikipedia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import numpy
+import glutils
+
+class QuadBatch:
+    """Vertex data for a set of unrotated, textured boxes, e.g. Words.
+
+    Quads are grouped by texture, so that each atlas page is drawn in one
+    call. `data' holds x, y, u, v for four vertices per quad; `groups' holds
+    (texture id, first vertex, vertex count). The rendering backend keeps its
+    own copy of the data in `buffer', refreshed when `dirty' is set.
+    """
+    def __init__(self):
+        self.data = numpy.zeros((0, 4), numpy.float32)
+        self.groups = []
+        self.serial = None
+        self.buffer = None
+        self.dirty = True
+
+    def update(self, quads, serial):
+        """Rebuild from `quads', unless already built for this `serial'.
+
+        Each quad is (texture id, shape, tex_shape), with shapes given as
+        (left, top, right, bottom) as for sprites. `quads' is only read if
+        the batch needs rebuilding, so it may be a generator.
+        """
+        if serial == self.serial:
+            return
+        self.serial = serial
+        by_texture = {}
+        for tex_id, shape, tex_shape in quads:
+            by_texture.setdefault(tex_id, []).append(tuple(shape) +
+                                                     tuple(tex_shape))
+        n = sum(len(group) for group in by_texture.itervalues())
+        data = numpy.empty((n, 4, 4), numpy.float32)
+        self.groups = []
+        i = 0
+        for tex_id, group in by_texture.iteritems():
+            self.groups.append((tex_id, 4 * i, 4 * len(group)))
+            q = numpy.array(group, numpy.float32)
+            # Corners go top left, top right, bottom right, bottom left
+            quad = data[i:i + len(group)]
+            quad[:, :, 0] = q[:, [0, 2, 2, 0]]
+            quad[:, :, 1] = q[:, [1, 1, 3, 3]]
+            quad[:, :, 2] = q[:, [4, 6, 6, 4]]
+            quad[:, :, 3] = q[:, [5, 5, 7, 7]]
+            i += len(group)
+        self.data = data.reshape(-1, 4)
+        self.dirty = True
+
+    def setQuads(self, tex_id, pos, shape, tex_shape):
+        """Replace the batch with copies of one quad, all with one texture.
+
+        `pos' is an (n, 2) array of positions, and `shape' and `tex_shape'
+        are (left, top, right, bottom) as for sprites.
+        """
+        left, top, right, bottom = shape
+        tl, tt, tr, tb = tex_shape
+        data = numpy.empty((len(pos), 4, 4), numpy.float32)
+        data[:, :, 0] = pos[:, 0, None] + (left, right, right, left)
+        data[:, :, 1] = pos[:, 1, None] + (top, top, bottom, bottom)
+        data[:, :, 2] = (tl, tr, tr, tl)
+        data[:, :, 3] = (tt, tt, tb, tb)
+        self.data = data.reshape(-1, 4)
+        self.groups = [(tex_id, 0, 4 * len(pos))]
+        self.serial = None
+        self.dirty = True
+
+    def render(self):
+        glutils.backend().drawQuads(self)
+
+    def release(self):
+        """Free the backend's copy of the data."""
+        if self.buffer is not None:
+            glutils.backend().deleteBuffer(self.buffer)
+            self.buffer = None
@@ -0,0 +1,265 @@
+#!/usr/bin/env python
+"""Time each stage of loading and playing on saved pages.
+
+Usage: benchmark.py [--fetch] [--synthetic] [--repeat N] [--json FILE]
+                    [--compare BASE.json] [page.html ...]
+
+Each page (by default every fixtures/*.html) is put through the stages in
+`STAGES' one at a time, `repeat' times, and the fastest and median times
+are reported. `--json' saves the results, with the commit they were taken
+at, and `--compare' shows how they stack up against results saved earlier.
+
+`--fetch' saves the articles in `ARTICLES', from a stub to the longest page
+in Wikipedia, to fixtures/ first, leaving alone any saved already, so that
+once checked in they are timed on the same HTML every run. `--synthetic'
+adds generated pages of similar shape, named synthetic-*, for when there is
+no network; they are not real articles, so compare them only with each
+other.
+
+Runs without a display, so rendering is timed up to handing vertices to the
+graphics card, but not the drawing itself.
+"""
+# Copyright 2013 Aaron Graham-Horowitz
+#
+# This file is part of Escape from Wikipedia.
+#
+# Escape from Wikipedia is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or any later version.
+#
+# Escape from Wikipedia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import sys, os, glob, gzip, json, random, argparse, subprocess, StringIO
+import timeit, platform, numpy, pygame
+from constants import *
+import glutils
+from scrapewiki import (PageDecoder, Page, Word, getHTML, cleanHTML,
+                        parseHTML, getTitle, layoutWords, rasterize,
+                        unrasterize, HTML404)
+from sprites import Jumper
+from creatures import Swarm
+
+ARTICLES = ('Solariellidae', 'Xkcd', 'Python_(programming_language)',
+            'Character_mask')
+WIKI = 'http://en.wikipedia.org/wiki/'
+SYNTHETIC = (('synthetic-small', 4), ('synthetic-medium', 40),
+             ('synthetic-huge', 400))   # (name, sections)
+STAGES = ('decode', 'clean', 'parse', 'layout', 'rasterize', 'index',
+          'collision', 'view', 'creatures')
+FRAMES = 500    # Frames simulated by the per-frame stages
+CREATURES = 2000    # Size of the crowd stepped by the creatures stage
+
+def fetchArticles(directory='fixtures'):
+    """Save each of `ARTICLES' not saved yet as directory/<name>.html."""
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    for name in ARTICLES:
+        path = os.path.join(directory, name + '.html')
+        if os.path.exists(path):
+            continue
+        html_doc = getHTML(WIKI + name)
+        if html_doc == HTML404.format(WIKI + name):
+            print('%s: could not fetch' % name)
+            continue
+        with open(path, 'wb') as f:
+            f.write(html_doc)
+        print('%s: saved %d bytes' % (name, len(html_doc)))
+
+def syntheticPage(sections, seed=0):
+    """Return made up HTML shaped like an article with `sections' sections."""
+    rng = random.Random(seed)
+    vocab = ['word%d' % i for i in xrange(500)] + ['ice', 'tar', 'honey']
+    text = lambda n: ' '.join(rng.choice(vocab) for _ in xrange(n))
+    body = ['<p>%s <b>%s</b> %s</p>' % (text(40), text(3), text(40))]
+    for i in xrange(sections):
+        body.append('<h2><span class="mw-headline" id="S%d">Section %d'
+                    '</span></h2>' % (i, i))
+        body.append('<p>%s <a href="/wiki/%s">%s</a> (%s)<sup>[%d]</sup>. '
+                    '<i>%s</i> %s</p>' % (text(60), rng.choice(vocab),
+                    text(2), text(2), i, text(5), text(80)))
+        body.append('<ul>%s</ul>' % ''.join('<li>%s</li>' % text(8)
+                                            for _ in xrange(3)))
+        body.append('<table><tr><td>%s</td></tr></table>' % text(20))
+    body.append('<h2><span class="mw-headline" id="References">References'
+                '</span></h2><p>%s</p>' % text(200))
+    return ('<html><head><title>Synthetic %d - Wikipedia, the free '
+            'encyclopedia</title></head><body>%s</body></html>' %
+            (sections, ''.join(body)))
+
+def benchPage(html_doc, repeat, parser=PARSER):
+    """Time every stage on one page. Return {stage: [seconds, ...]}, words."""
+    times = dict((stage, []) for stage in STAGES)
+    compressed = StringIO.StringIO()
+    with gzip.GzipFile(fileobj=compressed, mode='wb') as f:
+        f.write(html_doc)
+    compressed = compressed.getvalue()
+    for _ in xrange(repeat):
+        timer = Timer(times)
+        decoder = PageDecoder()
+        decoder.begin({'Content-Encoding': 'gzip'})
+        for i in xrange(0, len(compressed), HTTP_CHUNK):
+            if decoder.feed(compressed[i:i + HTTP_CHUNK]):
+                break
+        decoder.result()
+        timer.lap('decode')
+        cleaned = cleanHTML(html_doc)
+        timer.lap('clean')
+        soup = parseHTML(cleaned, parser)
+        timer.lap('parse')
+        Word.METRICS.clear()    # Measure text afresh each time
+        words, lines = [], []
+        for new_words, new_lines in layoutWords(soup):
+            words.extend(new_words)
+            lines.extend(new_lines)
+        timer.lap('layout')
+        keys = [w.key() for w in words]
+        for key in keys:
+            rasterize(key)
+        timer.lap('rasterize')
+        for key in keys:
+            unrasterize(key)
+        layout = (getTitle(soup), [w.record() for w in words], lines)
+        timer.restart()
+        page = Page(None, (None, html_doc, None, layout))
+        timer.lap('index')
+        benchCollision(page)
+        timer.lap('collision')
+        benchView(page)
+        timer.lap('view')
+        swarm = Swarm(CREATURES)
+        swarm.spawn(page, numpy.random.RandomState(0))
+        timer.restart()
+        benchCreatures(swarm, page)
+        timer.lap('creatures')
+        swarm.release()
+        page.release()
+    return times, len(words)
+
+def benchCollision(page):
+    """Drop a jumper onto words all over the page, once per frame."""
+    jumper = Jumper(shape=[0, 40, 20, 0])
+    words = page.words
+    step = max(1, len(words) // FRAMES)
+    for i in xrange(FRAMES):
+        if i % 50 == 0:
+            w = words[(i // 50 * step) % len(words)]
+            jumper.xy = ((w.left + w.right) / 2, w.top + 30)
+            jumper.velocity = [1.0, 0.0]
+            jumper.plat = None
+        jumper.goingright = True
+        jumper.update()
+        jumper.collide(page.near(jumper))
+
+def benchView(page):
+    """Scroll down the page, updating what is shown and batched each frame."""
+    dy = min(-1.0, page.bottom / FRAMES)
+    for i in xrange(FRAMES):
+        page.view(0, i * dy)
+        page.rasterize()
+        page.prepare()
+
+def benchCreatures(swarm, page):
+    """Step a crowd of wandering creatures on the page, once per frame."""
+    rng = numpy.random.RandomState(0)
+    for i in xrange(FRAMES):
+        swarm.wander(rng)
+        swarm.update()
+        swarm.collide(page)
+
+
+class Timer:
+    """Appends the time since the last lap to a list per stage."""
+    def __init__(self, times):
+        self.times = times
+        self.restart()
+
+    def restart(self):
+        self.start = timeit.default_timer()
+
+    def lap(self, stage):
+        now = timeit.default_timer()
+        self.times[stage].append(now - self.start)
+        self.start = now
+
+
+def commit():
+    """Return the current git commit, or None if not in a repository."""
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short',
+                                        'HEAD'], stderr=open(os.devnull,
+                                        'w')).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    argparser = argparse.ArgumentParser(
+            description='Time loading and playing on saved pages.')
+    argparser.add_argument('pages', nargs='*')
+    argparser.add_argument('--fetch', action='store_true',
+            help='save the benchmark articles to fixtures/ first')
+    argparser.add_argument('--synthetic', action='store_true',
+            help='also time generated pages')
+    argparser.add_argument('--repeat', type=int, default=5)
+    argparser.add_argument('--json', metavar='FILE',
+            help='save results to FILE')
+    argparser.add_argument('--compare', metavar='FILE',
+            help='compare with results saved to FILE')
+    args = argparser.parse_args()
+
+    glutils.setBackend('null')  # No display needed
+    pygame.font.init()
+    if args.fetch:
+        fetchArticles()
+    pages = [(os.path.splitext(os.path.basename(path))[0], path)
+             for path in (args.pages or
+                          sorted(glob.glob(os.path.join('fixtures',
+                                                        '*.html'))))]
+    if args.synthetic:
+        saved = set(name for name, _ in pages)
+        pages.extend(s for s in SYNTHETIC if s[0] not in saved)
+    if not pages:
+        sys.exit('No pages to time: try --fetch or --synthetic')
+
+    results = {'commit': commit(), 'python': platform.python_version(),
+               'parser': PARSER, 'repeat': args.repeat, 'frames': FRAMES,
+               'pages': {}}
+    base = None
+    if args.compare is not None:
+        with open(args.compare) as f:
+            base = json.load(f)['pages']
+    for name, source in pages:
+        if isinstance(source, int):
+            html_doc = syntheticPage(source)
+        else:
+            with open(source, 'rb') as f:
+                html_doc = f.read()
+        times, n_words = benchPage(html_doc, args.repeat)
+        stages = {}
+        for stage in STAGES:
+            t = sorted(times[stage])
+            stages[stage] = {'min': t[0], 'median': t[len(t) // 2]}
+        results['pages'][name] = {'bytes': len(html_doc), 'words': n_words,
+                                  'stages': stages}
+        print('%s: %d bytes, %d words' % (name, len(html_doc), n_words))
+        for stage in STAGES:
+            line = '  %-10s %10.3f ms' % (stage,
+                                          stages[stage]['min'] * 1000)
+            if base is not None and name in base:
+                old = base[name]['stages'][stage]['min']
+                line += '  %6.2fx' % (stages[stage]['min'] / old if old
+                                      else float('inf'))
+            print(line)
+    if args.json is not None:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=1, sort_keys=True)
+    pygame.quit()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+"""Crawl Wikipedia into a world pack, for playing without a network.
+
+Usage: buildworld.py [--pages N] [--workers N] [--output FILE] seed ...
+
+Starting from the seed articles, given as names or urls, links are followed
+breadth first until `pages' pages have been laid out. Pages are fetched on
+threads, and parsed and laid out in a pool of `workers' processes. Links to
+pages that did not make it into the pack are dropped, so that players stay
+inside it. Play the result with `wikigame.py --world FILE'.
+"""
+# Copyright 2013 Aaron Graham-Horowitz
+#
+# This file is part of Escape from Wikipedia.
+#
+# Escape from Wikipedia is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or any later version.
+#
+# Escape from Wikipedia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import argparse, multiprocessing, multiprocessing.pool, os, pygame
+from constants import *
+import layoutcache, worldpack
+from scrapewiki import getHTML, getSoup, getWords, HTML404
+from httpcache import isVolatile
+from worldpack import canonical
+
+WIKI = 'http://en.wikipedia.org/wiki/'
+
+def fetch(url):
+    """Return the HTML of `url', or None if it could not be fetched."""
+    html_doc = getHTML(url)
+    if html_doc == HTML404.format(url):
+        return None
+    return html_doc
+
+def layOut(html_doc):
+    """Lay out a page. Return it packed, and the urls it links to.
+
+    Return None if the page can't be laid out.
+    """
+    try:
+        title, words, lines = getWords(getSoup(html_doc))
+    except Exception:
+        return None
+    links = [canonical(w.hyperlink) for w in words if w.isLink()]
+    return layoutcache.pack(title, [w.record() for w in words], lines), links
+
+def startWorker():
+    pygame.font.init()
+
+def crawl(seeds, n_pages, workers):
+    """Lay out up to `n_pages' pages reachable from `seeds', breadth first.
+
+    Return a list of (url, packed layout, links), in the order crawled.
+    """
+    fetchers = multiprocessing.pool.ThreadPool(HTTP_POOL_SIZE)
+    layouts = multiprocessing.Pool(workers, startWorker)
+    seen = set(seeds)
+    frontier = list(seeds)
+    pages = []
+    try:
+        while frontier and len(pages) < n_pages:
+            wave = frontier[:n_pages - len(pages)]
+            frontier = frontier[len(wave):]
+            fetched = [(url, html_doc) for url, html_doc in
+                       zip(wave, fetchers.map(fetch, wave))
+                       if html_doc is not None]
+            laid_out = layouts.map(layOut, [html_doc for _, html_doc in
+                                            fetched])
+            for (url, _), laid in zip(fetched, laid_out):
+                if laid is None:
+                    print('%s: could not be laid out, skipped' % url)
+                    continue
+                data, links = laid
+                pages.append((url, data, links))
+                for link in links:
+                    if link not in seen and not isVolatile(link):
+                        seen.add(link)
+                        frontier.append(link)
+            print('%d pages laid out, %d more found' % (len(pages),
+                                                        len(frontier)))
+    finally:
+        fetchers.terminate()
+        layouts.terminate()
+    return pages
+
+def seal(pages):
+    """Generate (url, packed layout), dropping links that leave `pages'."""
+    inside = set(url for url, _, _ in pages)
+    for url, data, links in pages:
+        if all(link in inside for link in links):
+            yield url, data
+            continue
+        title, records, lines = layoutcache.unpack(data)
+        sealed = []
+        for text, link, left, bottom, attr, size, color, ff in records:
+            if link and canonical(link) not in inside:
+                link, color = "", BLACK
+            sealed.append((text, link, left, bottom, attr, size, color, ff))
+        yield url, layoutcache.pack(title, sealed, lines)
+
+def main():
+    argparser = argparse.ArgumentParser(
+            description='Crawl Wikipedia into a world pack.')
+    argparser.add_argument('seeds', nargs='+')
+    argparser.add_argument('--pages', type=int, default=WORLD_PAGES,
+            help='number of pages to lay out')
+    argparser.add_argument('--workers', type=int,
+            default=multiprocessing.cpu_count(),
+            help='processes laying out pages')
+    argparser.add_argument('--output', default=WORLD_PACK)
+    args = argparser.parse_args()
+
+    seeds = [canonical(s if s.startswith('http') else
+                       WIKI + s.replace(' ', '_')) for s in args.seeds]
+    pages = crawl(seeds, args.pages, args.workers)
+    if not pages:
+        raise SystemExit('No pages could be fetched')
+    worldpack.write(args.output, seal(pages))
+    print('%d pages, %d bytes written to %s' % (len(pages),
+          os.path.getsize(args.output), args.output))
+
+
+if __name__ == '__main__':
+    main()
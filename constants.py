@@ -32,8 +32,12 @@ PARSPACE  = 150
 INDENT    = 60
 LINE_PADDING = 6
 
+GRID_CELL = 200         # Size of the cells indexing words on a page.
+
 PLAYER_START = (100, 200)
 PLAYER_SCALE = 0.75
+RESET_TRIES = 10        # Attempts to find a clear word to start on.
+SPAWN_SCREENS = 3       # Screens of a page to pick a starting word from.
 
 CAMERASLACK = 80      # How far from the center the player moves before
                       # moving the camera.
@@ -73,3 +77,56 @@ SMALL_FONT_SIZE  = 36
 MEDIUM_FONT_SIZE = 48
 LARGE_FONT_SIZE  = 92
 
+ATLAS_SIZE = 1024       # Width and height of each word texture atlas page.
+ATLAS_PADDING = 2       # Empty texels between packed images, to stop bleeding.
+TEXTURE_BUDGET = 64 * 1024 * 1024  # Texture bytes above which unused
+                                   # cached images are deleted, and words
+                                   # out of view are released.
+
+PREFETCH_SLOTS = 4      # Pages kept fetching or fetched in the background.
+PREFETCH_WORKERS = 2    # Threads fetching pages in the background.
+BUILD_BUDGET = 4        # Milliseconds per frame spent laying out pages.
+CACHE_DIR = 'cache'     # Where fetched pages are kept between sessions.
+CACHE_LIMIT = 64 * 1024 * 1024  # Bytes of compressed pages to keep on disk.
+CACHE_SAVE_HITS = 32    # Cache reads between writes of the cache index.
+LAYOUT_VERSION = 1      # Bump whenever page layout changes, to drop
+                        # cached layouts.
+LAYOUT_CACHE_LIMIT = 32 * 1024 * 1024   # Bytes of cached layouts to keep.
+RECORD_BLOCK = 100      # Words per block when building from a cached layout.
+HTTP_POOL_SIZE = 4      # Most connections open to Wikipedia at once.
+HTTP_TIMEOUT = 10       # Seconds to wait on a silent connection.
+HTTP_REDIRECTS = 5      # Most redirects followed for one page.
+HTTP_STATS = 100        # Number of recent request timings kept.
+HTTP_CHUNK = 16 * 1024  # Bytes read from the network at a time.
+CUTOFF_SECTION = 'References'   # Id of the section where pages are cut off,
+                                # or None to read whole pages.
+DECODE_WINDOW = 256     # Bytes kept between chunks when looking for cutoff.
+PARSER = None           # HTML parser backend from `scrapewiki.PARSERS', or
+                        # None to use the best one installed.
+RASTER_BUDGET = 4       # Milliseconds per frame spent rendering words.
+RELEASE_MARGIN = WINWIDTH   # Distance beyond the view at which rendered
+                            # words are released.
+METRICS_LIMIT = 50000   # Most word sizes remembered.
+RENDER_BACKEND = 'gl'   # 'gl' to draw, or 'null' to run without a display.
+PROFILE_HISTORY = 240   # Frames shown in the profiler's graph.
+PROFILE_REFRESH = 15    # Frames between redraws of the profiler overlay.
+PROFILE_CSV = 'profile.csv'     # Where profiled frames are written.
+TRACE_EVENTS = 200000   # Most spans kept when tracing page loads.
+LOAD_SUMMARY = 'loads.jsonl'    # Per-page load times, added to each session.
+NPC_COUNT = 0           # Creatures roaming each page alongside the player.
+WORLD_PACK = 'world.pack'   # Default file for `buildworld' to write.
+WORLD_PAGES = 500       # Pages `buildworld' crawls by default.
+PARSE_WORKERS = 2       # Processes laying out pages off the game's thread.
+PARSE_SPARES = 2        # Processes started with them, to replace any that
+                        # hang or die, as the game can't safely start more.
+PARSE_TIMEOUT = 30      # Seconds to wait on a page being laid out, before
+                        # giving up and showing the error page instead.
+RANDOM_URL = 'http://en.wikipedia.org/wiki/Special:Random'
+RANDOM_PAGES = 2        # Random pages kept fetched and parsed, for restarts.
+RANDOM_RETRY = 5        # Seconds to wait before fetching a random page
+                        # again, when the last try failed.
+HISTORY_BUDGET = 64 * 2 ** 20   # Bytes of pages kept built for going back
+                                # and forward.
+GRID_ENTRY_BYTES = 32   # Rough memory taken by each word in a page's grid.
+START_PAGE = 'pages/start.html'     # Bundled page the game opens on,
+                                    # playable while the first article loads.
@@ -0,0 +1,238 @@
+"""Crowds of jumping creatures, simulated together with NumPy.
+"""
+# Copyright 2013 Aaron Graham-Horowitz
+#
+# This file is part of Escape from Wikipedia.
+#
+# Escape from Wikipedia is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or any later version.
+#
+# Escape from Wikipedia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import numpy
+from constants import *
+import glutils
+from batch import QuadBatch
+
+class Platforms:
+    """The boxes and friction of a page's Words, as arrays.
+
+    `boxes' holds left, top, right, bottom per Word, in the order the Words
+    were added. `order' sorts them by top, for `candidates'.
+    """
+    def __init__(self):
+        self.boxes = numpy.zeros((0, 4), numpy.float32)
+        self.ff = numpy.zeros(0)
+        self.order = numpy.zeros(0, numpy.intp)
+        self.tops = numpy.zeros(0, numpy.float32)
+        self.tallest = 0.0
+
+    def extend(self, words):
+        """Catch up with `words', a `WordStore' that only ever grows."""
+        start = len(self.ff)
+        if len(words) == start:
+            return
+        # Copied at once, as the arrays move in memory when they grow
+        boxes = numpy.frombuffer(words.grid.boxes, numpy.float32)
+        boxes = boxes.reshape(-1, 4)[start:].copy()
+        ff = numpy.frombuffer(words.ff)[start:].copy()
+        self.boxes = numpy.concatenate((self.boxes, boxes))
+        self.ff = numpy.concatenate((self.ff, ff))
+        self.order = numpy.argsort(self.boxes[:, 1], kind='mergesort')
+        self.tops = self.boxes[self.order, 1]
+        self.tallest = max(self.tallest, float((boxes[:, 1] -
+                                                boxes[:, 3]).max()))
+
+    def candidates(self, left, top, right, bottom):
+        """Return (box index, platform index) for every box overlap.
+
+        Boxes are given as arrays of edges, and touching counts as overlap,
+        as with `rabbyt.collisions'. Pairs are sorted by box, then platform.
+        """
+        # A platform can only overlap a box if its top lies between the
+        # box's bottom and the box's top plus the tallest platform.
+        lo = numpy.searchsorted(self.tops, bottom, 'left')
+        hi = numpy.searchsorted(self.tops, top + self.tallest, 'right')
+        counts = hi - lo
+        total = counts.sum()
+        if total == 0:
+            return numpy.zeros(0, numpy.intp), numpy.zeros(0, numpy.intp)
+        box = numpy.repeat(numpy.arange(len(lo)), counts)
+        starts = numpy.cumsum(counts) - counts
+        plat = self.order[numpy.repeat(lo - starts, counts) +
+                          numpy.arange(total)]
+        p = self.boxes[plat]
+        hit = ((p[:, 0] <= right[box]) & (p[:, 2] >= left[box]) &
+               (p[:, 3] <= top[box]) & (p[:, 1] >= bottom[box]))
+        box, plat = box[hit], plat[hit]
+        sort = numpy.lexsort((plat, box))
+        return box[sort], plat[sort]
+
+
+class Swarm:
+    """`n' creatures that each move like a `sprites.Jumper'.
+
+    State is kept one array per attribute, so that `update' and `collide'
+    step every creature at once. `going' is -1, 0 or 1 for left, still or
+    right, and `plat' is the index of the platform stood on, or -1.
+    Creatures share one image.
+    """
+    def __init__(self, n, image=os.path.join('images', 'player.png'),
+                 speed=1, jumpspeed=1, grav=1, max_jumps=1):
+        self.texture, (width, height) = glutils.loadTexture(image)
+        self.shape = numpy.array([0, height, width, 0], numpy.float32)
+        self.pos = numpy.zeros((n, 2), numpy.float32)
+        self.prev = self.pos.copy()     # Positions before the last step
+        self.vel = numpy.zeros((n, 2))
+        self.speed = numpy.full(n, speed * BASE_SPEED)
+        self.jumpspeed = numpy.full(n, jumpspeed * BASE_JUMPSPEED)
+        self.gaccel = numpy.full(n, grav * G_ACCEL)
+        self.jumps = numpy.ones(n, numpy.int32)
+        self.max_jumps = numpy.full(n, max_jumps, numpy.int32)
+        self.going = numpy.zeros(n, numpy.int8)
+        self.plat = numpy.full(n, -1, numpy.intp)
+        self.plat_ff = numpy.zeros(n)
+        self.plat_edges = numpy.zeros((n, 2), numpy.float32)  # left, right
+        self.platforms = Platforms()
+        self.page = None
+        self.batch = QuadBatch()
+
+    def __len__(self):
+        return len(self.pos)
+
+    def edges(self, i=slice(None)):
+        """Return the left, top, right and bottom edges of creatures `i'."""
+        x, y = self.pos[i, 0], self.pos[i, 1]
+        s = self.shape
+        return x + s[0], y + s[1], x + s[2], y + s[3]
+
+    def spawn(self, page, rng):
+        """Drop every creature onto a random Word of `page'."""
+        words = page.words
+        if not len(self):
+            return
+        picks = rng.randint(0, len(words), len(self))
+        for i, k in enumerate(picks):
+            w = words[k]
+            self.pos[i] = ((w.left + w.right) / 2, w.top + 1 - self.shape[3])
+        self.prev[:] = self.pos
+        self.vel[:] = 0
+        self.plat[:] = -1
+        self.jumps[:] = 1
+
+    def resting(self):
+        """True if no creature moved in the last step."""
+        return bool((self.pos == self.prev).all())
+
+    def wander(self, rng, turn=0.01, leap=0.005):
+        """Have creatures now and then change direction or jump."""
+        n = len(self)
+        turning = rng.random_sample(n) < turn
+        self.going[turning] = rng.randint(-1, 2, turning.sum())
+        self.jump(rng.random_sample(n) < leap)
+
+    def update(self):
+        """Step every creature as `Jumper.update' would."""
+        self.prev[:] = self.pos
+        on = self.plat >= 0
+        ff = numpy.where(on, self.plat_ff, 0.98)
+        rff = 1 - ff ** 4
+        vel = self.vel
+        vel[:, 0] *= ff
+        vel[:, 0] += self.going * (self.speed * rff)
+        vel[:, 1] += numpy.where(on, 0.0, self.gaccel)
+        numpy.clip(vel, -MAX_VELOCITY, MAX_VELOCITY, out=vel)
+        self.pos += vel
+        # Detect walk off platform
+        left, _, right, _ = self.edges()
+        off = on & ((left > self.plat_edges[:, 1]) |
+                    (right < self.plat_edges[:, 0]))
+        self.plat[off] = -1
+        self.jumps[off] += 1
+
+    def collide(self, page):
+        """Push creatures out of `page's Words, as `Jumper.collide' would.
+
+        Return the platform index each creature landed on, or -1.
+        """
+        if page is not self.page:
+            self.page = page
+            self.platforms = Platforms()
+        platforms = self.platforms
+        platforms.extend(page.words)
+        landed = numpy.full(len(self), -1, numpy.intp)
+        box, plat = platforms.candidates(*self.edges())
+        if len(box) == 0:
+            return landed
+        # A creature touching several Words deals with them one at a time,
+        # in order, so handle every creature's first Word, then second...
+        first = numpy.searchsorted(box, box, 'left')
+        rank = numpy.arange(len(box)) - first
+        for r in xrange(rank.max() + 1):
+            now = rank == r
+            self.resolve(box[now], plat[now], landed)
+        return landed
+
+    def resolve(self, c, p, landed):
+        """Push creatures `c' out of platforms `p', one platform each."""
+        left, top, right, bottom = [e.astype(numpy.float64)
+                                    for e in self.edges(c)]
+        pl, pt, pr, pb = self.platforms.boxes[p].astype(numpy.float64).T
+        vx, vy = self.vel[c, 0], self.vel[c, 1]
+        s = self.shape.astype(numpy.float64)
+        from_left = (right / 3 + 2 * left / 3 < pl) & (vx > 0)
+        rest = ~from_left
+        from_right = rest & (left / 3 + 2 * right / 3 > pr) & (vx < 0)
+        rest &= ~from_right
+        from_above = rest & (top > pt) & (vy < 0)
+        rest &= ~from_above
+        from_below = rest & (2 * top / 3 + bottom / 3 < pb) & (vy > 0)
+
+        i = c[from_left]
+        self.pos[i, 0] = pl[from_left] - 1 - s[2]
+        i = c[from_right]
+        self.pos[i, 0] = pr[from_right] + 1 - s[0]
+        i = c[from_above]
+        self.pos[i, 1] = pt[from_above] + 1 - s[3]
+        self.plat[i] = p[from_above]
+        self.plat_ff[i] = self.platforms.ff[p[from_above]]
+        self.plat_edges[i, 0] = pl[from_above]
+        self.plat_edges[i, 1] = pr[from_above]
+        self.vel[i, 1] = 0      # Stop falling
+        self.jumps[i] = 0       # Reset jumps
+        landed[i] = p[from_above]
+        i = c[from_below]
+        self.pos[i, 1] = pb[from_below] - 1 - s[1]
+        self.vel[i, 1] = 0      # Jump stops
+
+    def jump(self, mask):
+        """Make creatures in `mask' jump, as `Jumper.jump' would.
+
+        Creatures get no boost for jumping off a hyperlink.
+        """
+        can = mask & (self.jumps < self.max_jumps)
+        js = self.jumpspeed[can] * numpy.where(self.jumps[can] > 0,
+                                               DOUBLE_JUMP_PENALTY, 1.0)
+        self.plat[can] = -1
+        self.jumps[can] += 1
+        self.vel[can, 1] = js
+
+    def render(self, alpha=1.0):
+        """Draw every creature, `alpha' of the way through the last step."""
+        if not len(self):
+            return
+        pos = self.prev + alpha * (self.pos - self.prev)
+        self.batch.setQuads(self.texture, pos, self.shape, (0, 1, 1, 0))
+        self.batch.render()
+
+    def release(self):
+        glutils.releaseTexture(self.texture)
+        self.batch.release()
@@ -1,4 +1,9 @@
 """Helper functions and wrappers into OpenGL.
+
+All drawing goes through a rendering backend. The default, 'gl', talks to
+OpenGL; 'null' does no drawing at all, so that pages and physics can run
+without a display, e.g. for benchmarks. Choose with `setBackend' before any
+textures are made.
 """
 # Copyright 2013 Aaron Graham-Horowitz
 # 
@@ -16,30 +21,248 @@
 # You should have received a copy of the GNU General Public License along with
 # this program.  If not, see <http://www.gnu.org/licenses/>.
 
-import pygame
-from OpenGL.GL import *
-from ctypes import *
+import pygame, itertools
+from tracing import TRACER
 from constants import *
 
-def getTexture(surf):
-    """Helper function, create texture to display `text' and return id."""
-    # Open unused texture id
-    tex_id = glGenTextures(1)
-    glBindTexture(GL_TEXTURE_2D, tex_id)
-    # Take pixel data in byte order
-    glPixelStorei(GL_UNPACK_ALIGNMENT, 1)
-    # Ensure sane defaults are set for parameters
-    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_CLAMP_TO_EDGE)
-    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_CLAMP_TO_EDGE)
-    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
-    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_LINEAR)
-    # Upload image data to texture
-    glTexImage2D(GL_TEXTURE_2D, 0, GL_RGBA, surf.get_width(),
-            surf.get_height(), 0, GL_RGBA, GL_UNSIGNED_BYTE,
-            pygame.image.tostring(surf, "RGBA", 1))
+class GLBackend:
+    """Draws with OpenGL. Needs a display opened with pygame.OPENGL."""
+    def __init__(self):
+        from OpenGL import GL
+        self.GL = GL
+
+    def setTexParameters(self):
+        """Ensure sane defaults are set for the bound texture's parameters."""
+        GL = self.GL
+        GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_WRAP_S,
+                GL.GL_CLAMP_TO_EDGE)
+        GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_WRAP_T,
+                GL.GL_CLAMP_TO_EDGE)
+        GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MAG_FILTER,
+                GL.GL_LINEAR)
+        GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MIN_FILTER,
+                GL.GL_LINEAR)
+
+    def createTexture(self, width, height, data=None):
+        """Upload RGBA pixel data, bottom row first, and return texture id.
+
+        With no data, the texture is fully transparent.
+        """
+        GL = self.GL
+        if data is None:
+            data = '\0' * (width * height * 4)
+        # Open unused texture id
+        tex_id = GL.glGenTextures(1)
+        GL.glBindTexture(GL.GL_TEXTURE_2D, tex_id)
+        # Take pixel data in byte order
+        GL.glPixelStorei(GL.GL_UNPACK_ALIGNMENT, 1)
+        self.setTexParameters()
+        GL.glTexImage2D(GL.GL_TEXTURE_2D, 0, GL.GL_RGBA, width, height, 0,
+                GL.GL_RGBA, GL.GL_UNSIGNED_BYTE, data)
+        return tex_id
+
+    def updateTexture(self, tex_id, x, y, width, height, data):
+        """Overwrite part of a texture with RGBA pixel data."""
+        GL = self.GL
+        GL.glBindTexture(GL.GL_TEXTURE_2D, tex_id)
+        GL.glPixelStorei(GL.GL_UNPACK_ALIGNMENT, 1)
+        GL.glTexSubImage2D(GL.GL_TEXTURE_2D, 0, x, y, width, height,
+                GL.GL_RGBA, GL.GL_UNSIGNED_BYTE, data)
+
+    def deleteTexture(self, tex_id):
+        self.GL.glDeleteTextures([tex_id])
+
+    def loadImage(self, path):
+        return pygame.image.load(path).convert_alpha()
+
+    def pixels(self, surf):
+        return pygame.image.tostring(surf, "RGBA", 1)
+
+    def translate(self, x, y):
+        self.GL.glTranslatef(x, y, 0)
+
+    def drawQuads(self, batch):
+        """Draw a `batch.QuadBatch', one call per texture.
+
+        The vertices are kept in a buffer object on the GPU, and only
+        uploaded again when the batch has changed.
+        """
+        GL = self.GL
+        if not batch.groups:
+            return
+        if batch.buffer is None:
+            from OpenGL.arrays import vbo
+            batch.buffer = vbo.VBO(batch.data)
+        elif batch.dirty:
+            batch.buffer.set_array(batch.data)
+        batch.dirty = False
+        GL.glEnable(GL.GL_TEXTURE_2D)
+        GL.glColor4f(1, 1, 1, 1)
+        batch.buffer.bind()
+        GL.glEnableClientState(GL.GL_VERTEX_ARRAY)
+        GL.glEnableClientState(GL.GL_TEXTURE_COORD_ARRAY)
+        GL.glVertexPointer(2, GL.GL_FLOAT, 16, batch.buffer)
+        GL.glTexCoordPointer(2, GL.GL_FLOAT, 16, batch.buffer + 8)
+        for tex_id, first, count in batch.groups:
+            GL.glBindTexture(GL.GL_TEXTURE_2D, tex_id)
+            GL.glDrawArrays(GL.GL_QUADS, first, count)
+        GL.glDisableClientState(GL.GL_TEXTURE_COORD_ARRAY)
+        GL.glDisableClientState(GL.GL_VERTEX_ARRAY)
+        batch.buffer.unbind()
+
+    def deleteBuffer(self, buf):
+        buf.delete()
+
+
+class NullBackend:
+    """Draws nothing. Texture ids are handed out, but no pixels are kept."""
+    def __init__(self):
+        self.ids = itertools.count(1)
+
+    def createTexture(self, width, height, data=None):
+        return next(self.ids)
+
+    def updateTexture(self, tex_id, x, y, width, height, data):
+        pass
+
+    def deleteTexture(self, tex_id):
+        pass
+
+    def loadImage(self, path):
+        return pygame.image.load(path)  # No display to convert for
+
+    def pixels(self, surf):
+        return None
+
+    def translate(self, x, y):
+        pass
+
+    def drawQuads(self, batch):
+        pass
+
+    def deleteBuffer(self, buf):
+        pass
+
+
+BACKENDS = {'gl' : GLBackend, 'null' : NullBackend}
+BACKEND = None
+
+def setBackend(name):
+    """Choose rendering backend by name, from `BACKENDS'."""
+    global BACKEND
+    BACKEND = BACKENDS[name]()
+
+def backend():
+    """Return the rendering backend, starting the default one if need be."""
+    if BACKEND is None:
+        setBackend(RENDER_BACKEND)
+    return BACKEND
+
+class TextureManager:
+    """Keeps track of every live texture, so that none of them leak.
+
+    Each texture has a reference count; it is deleted once nothing uses it.
+    Textures loaded from image files are cached by path, and are kept after
+    their last release until the byte budget forces them out.
+    """
+    def __init__(self, budget=TEXTURE_BUDGET):
+        self.budget = budget
+        self.textures = {}   # tex_id -> [reference count, bytes, path]
+        self.paths = {}      # path -> (tex_id, (width, height))
+        self.unused = []     # Released cached textures, oldest first
+        self.bytes = 0
+
+    def add(self, tex_id, width, height, path=None):
+        """Register a newly created texture, with one reference to it."""
+        self.textures[tex_id] = [1, width * height * 4, path]
+        self.bytes += width * height * 4
+        self.enforceBudget()
+
+    def retain(self, tex_id):
+        ref = self.textures[tex_id]
+        if ref[0] == 0:
+            self.unused.remove(tex_id)
+        ref[0] += 1
+
+    def release(self, tex_id):
+        ref = self.textures[tex_id]
+        ref[0] -= 1
+        if ref[0] > 0:
+            return
+        if ref[2] is None:
+            self.delete(tex_id)
+        else:
+            self.unused.append(tex_id)
+            self.enforceBudget()
+
+    def delete(self, tex_id):
+        _, size, path = self.textures.pop(tex_id)
+        if path is not None:
+            del self.paths[path]
+        self.bytes -= size
+        backend().deleteTexture(tex_id)
+
+    def enforceBudget(self):
+        """Delete released cached textures until within the byte budget."""
+        while self.bytes > self.budget and self.unused:
+            self.delete(self.unused.pop(0))
+
+    def stats(self):
+        """Return number of live textures and the bytes they occupy."""
+        return len(self.textures), self.bytes
+
+
+MANAGER = TextureManager()
+
+def getTexture(surf, path=None):
+    """Helper function, create texture to display `text' and return id.
+
+    The caller owns one reference to the texture, and must hand it back with
+    `releaseTexture' when done with it.
+    """
+    b = backend()
+    with TRACER.span('upload', bytes=4 * surf.get_width() * surf.get_height()):
+        tex_id = b.createTexture(surf.get_width(), surf.get_height(),
+                                 b.pixels(surf))
+    MANAGER.add(tex_id, surf.get_width(), surf.get_height(), path)
+    return tex_id
+
+def getBlankTexture(width, height):
+    """Create a fully transparent texture of the given size and return id."""
+    tex_id = backend().createTexture(width, height)
+    MANAGER.add(tex_id, width, height)
     return tex_id
 
+def subTexture(tex_id, x, y, surf):
+    """Copy `surf' into texture `tex_id' with its bottom-left corner at x, y."""
+    b = backend()
+    with TRACER.span('upload', bytes=4 * surf.get_width() * surf.get_height()):
+        b.updateTexture(tex_id, x, y, surf.get_width(), surf.get_height(),
+                        b.pixels(surf))
+
+def loadTexture(path):
+    """Return texture id and size for image file `path', loading it once only.
+
+    Like `getTexture', the caller owns one reference to the texture.
+    """
+    if path in MANAGER.paths:
+        tex_id, size = MANAGER.paths[path]
+        MANAGER.retain(tex_id)
+        return tex_id, size
+    image = backend().loadImage(path)
+    tex_id = getTexture(image, path)
+    MANAGER.paths[path] = (tex_id, image.get_size())
+    return tex_id, image.get_size()
+
+def releaseTexture(tex_id):
+    """Drop a reference to a texture, deleting it if it is no longer used."""
+    MANAGER.release(tex_id)
+
+def textureStats():
+    """Return number of live textures and the bytes they occupy."""
+    return MANAGER.stats()
+
 def scroll(x, y):
     """Wrapper for glTranslatef, in 2-D with reversed coordinates."""
-    glTranslatef(-x, -y, 0)
+    backend().translate(-x, -y)
 
@@ -0,0 +1,122 @@
+"""Going back and forward between pages visited, as in a browser.
+"""
+# Copyright 2013 Aaron Graham-Horowitz
+#
+# This file is part of Escape from Wikipedia.
+#
+# Escape from Wikipedia is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or any later version.
+#
+# Escape from Wikipedia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import collections
+from constants import *
+from httpcache import isVolatile
+
+class Visit:
+    """A page left behind: its url, and where the player and camera were.
+
+    `page' is the built page, while it is kept.
+    """
+    def __init__(self, page, pos, camera):
+        self.url = page.url
+        self.page = page
+        self.pos = pos
+        self.camera = camera
+
+
+class History:
+    """Pages visited before and after the current one, as `Visit's.
+
+    Built pages are kept, so that going back to one needs no loading. They
+    are `Page.shelve'd on leaving, which frees the textures of their words,
+    as those can be rasterized again in a frame. Once their
+    `Page.footprint's add up to more than `budget' bytes, the least recently left are released, to be loaded again if
+    wanted. A random page can't be loaded again, so once released it is
+    dropped from the history.
+    """
+    def __init__(self, budget=HISTORY_BUDGET):
+        self.budget = budget
+        self.behind = []    # Back, most recent last
+        self.ahead = []     # Forward, next last
+        self.kept = collections.OrderedDict()   # Visit -> footprint
+        self.size = 0
+
+    def follow(self, page, pos, camera):
+        """Leave `page' by a link. Forget the pages ahead."""
+        self.leave(page, pos, camera, self.behind)
+        ahead, self.ahead = self.ahead, []
+        for visit in ahead:
+            self.drop(visit)
+
+    def back(self, page, pos, camera):
+        """Leave `page' for the one before. Return its `Visit', or None.
+
+        The `Visit's `page' is None if it has to be loaded again.
+        """
+        if not self.behind:
+            return None
+        return self.arrive(self.behind.pop(), page, pos, camera, self.ahead)
+
+    def forward(self, page, pos, camera):
+        """Leave `page' for the one after. Return its `Visit', or None."""
+        if not self.ahead:
+            return None
+        return self.arrive(self.ahead.pop(), page, pos, camera, self.behind)
+
+    def arrive(self, visit, page, pos, camera, stack):
+        # Take the page first, so that leaving can't release it
+        visit.page = self.take(visit)
+        self.leave(page, pos, camera, stack)
+        return visit
+
+    def leave(self, page, pos, camera, stack):
+        visit = Visit(page, pos, camera)
+        stack.append(visit)
+        page.shelve()
+        footprint = page.footprint()
+        self.kept[visit] = footprint
+        self.size += footprint
+        while self.size > self.budget:
+            self.drop(next(iter(self.kept)))
+
+    def take(self, visit):
+        """Stop keeping `visit's page and return it, or None if released."""
+        page = visit.page
+        if page is not None:
+            self.size -= self.kept.pop(visit)
+            visit.page = None
+        return page
+
+    def find(self, url):
+        """Return a kept page for `url' for use again, or None."""
+        if isVolatile(url):
+            return None
+        for visit in reversed(self.kept):
+            if visit.url == url:
+                return self.take(visit)
+        return None
+
+    def drop(self, visit):
+        """Release `visit's page, if kept."""
+        page = self.take(visit)
+        if page is not None:
+            page.release()
+        if isVolatile(visit.url):
+            for stack in (self.behind, self.ahead):
+                if visit in stack:
+                    stack.remove(visit)
+
+    def release(self):
+        """Release every page kept. Call when the game ends."""
+        self.behind = []
+        self.ahead = []
+        for visit in list(self.kept):
+            self.drop(visit)
@@ -0,0 +1,151 @@
+"""Persistent on-disk cache of fetched web pages.
+"""
+# Copyright 2013 Aaron Graham-Horowitz
+#
+# This file is part of Escape from Wikipedia.
+#
+# Escape from Wikipedia is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or any later version.
+#
+# Escape from Wikipedia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os, json, zlib, hashlib, threading, time, random, atexit
+from constants import *
+
+class DiskCache:
+    """Page bodies stored compressed on disk, with headers to revalidate them.
+
+    Entries are keyed by the url a request finally resolved to; the url first
+    asked for is remembered as an alias, unless it names a page that changes
+    on every visit, like Special:Random. When the cache grows past `limit'
+    bytes, the least recently used entries are deleted. Shared by all threads.
+    Reads only mark entries used; the index is written every CACHE_SAVE_HITS
+    of them, with any other change, and by `flush' on exit.
+    """
+    def __init__(self, directory=CACHE_DIR, limit=CACHE_LIMIT):
+        self.directory = directory
+        self.limit = limit
+        self.lock = threading.Lock()
+        self.index_path = os.path.join(directory, 'index.json')
+        self.entries = {}   # url -> {'file', 'size', 'used', 'etag', 'modified'}
+        self.aliases = {}   # requested url -> resolved url
+        self.unsaved = 0    # Reads since the index was written
+        try:
+            with open(self.index_path) as f:
+                index = json.load(f)
+            self.entries = index['entries']
+            self.aliases = index['aliases']
+        except (IOError, ValueError, KeyError):
+            pass
+
+    def resolve(self, url):
+        return self.aliases.get(url, url)
+
+    def lookup(self, url):
+        """Return the validators (ETag, Last-Modified) cached for `url'.
+
+        Return None if `url' is not cached or should always be refetched.
+        """
+        if isVolatile(url):
+            return None
+        with self.lock:
+            entry = self.entries.get(self.resolve(url))
+            if entry is None:
+                return None
+            return entry['etag'], entry['modified']
+
+    def read(self, url):
+        """Return the cached body for `url', or None if there is none."""
+        with self.lock:
+            entry = self.entries.get(self.resolve(url))
+            if entry is None:
+                return None
+            try:
+                with open(os.path.join(self.directory, entry['file']),
+                          'rb') as f:
+                    body = zlib.decompress(f.read())
+            except (IOError, zlib.error):
+                self.remove(self.resolve(url))
+                self.save()
+                return None
+            entry['used'] = time.time()
+            self.unsaved += 1
+            if self.unsaved >= CACHE_SAVE_HITS:
+                self.save()
+            return body
+
+    def readAny(self):
+        """Return a random cached body, or None if the cache is empty."""
+        with self.lock:
+            urls = self.entries.keys()
+        if not urls:
+            return None
+        return self.read(random.choice(urls))
+
+    def store(self, requested, url, body, etag=None, modified=None):
+        """Save `body', fetched from `url' after asking for `requested'."""
+        name = hashlib.sha1(url).hexdigest()
+        data = zlib.compress(body)
+        with self.lock:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            with open(os.path.join(self.directory, name), 'wb') as f:
+                f.write(data)
+            self.entries[url] = {'file': name, 'size': len(data),
+                                 'used': time.time(), 'etag': etag,
+                                 'modified': modified}
+            if requested != url and not isVolatile(requested):
+                self.aliases[requested] = url
+            self.evict()
+            self.save()
+
+    def evict(self):
+        """Delete least recently used entries until within the size limit."""
+        total = sum(e['size'] for e in self.entries.itervalues())
+        by_age = sorted(self.entries, key=lambda u: self.entries[u]['used'])
+        while total > self.limit and by_age:
+            url = by_age.pop(0)
+            total -= self.entries[url]['size']
+            self.remove(url)
+
+    def remove(self, url):
+        entry = self.entries.pop(url)
+        for alias in [a for a, u in self.aliases.iteritems() if u == url]:
+            del self.aliases[alias]
+        try:
+            os.remove(os.path.join(self.directory, entry['file']))
+        except OSError:
+            pass
+
+    def flush(self):
+        """Write the index if reads have changed it since it was written."""
+        with self.lock:
+            if self.unsaved:
+                self.save()
+
+    def save(self):
+        """Write the index to disk, replacing the old one only once complete."""
+        self.unsaved = 0
+        if not os.path.isdir(self.directory):
+            return
+        tmp = self.index_path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'entries': self.entries, 'aliases': self.aliases}, f)
+        if os.path.exists(self.index_path):
+            os.remove(self.index_path)   # Windows won't rename over a file
+        os.rename(tmp, self.index_path)
+
+
+CACHE = DiskCache()
+atexit.register(CACHE.flush)
+
+def isVolatile(url):
+    """True if `url' gives a different page every time, e.g. Special:Random."""
+    return 'Special:' in url
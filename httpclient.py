@@ -0,0 +1,158 @@
+"""HTTP/1.1 client that keeps connections open between requests.
+"""
+# Copyright 2013 Aaron Graham-Horowitz
+#
+# This file is part of Escape from Wikipedia.
+#
+# Escape from Wikipedia is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or any later version.
+#
+# Escape from Wikipedia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import httplib, socket, urlparse, threading, collections, time
+from constants import *
+
+REDIRECTS = (301, 302, 303, 307, 308)
+
+class Response:
+    """A complete response. Has `info' and `read' like a urllib2 response."""
+    def __init__(self, url, status, headers, body):
+        self.url = url
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+    def geturl(self):
+        return self.url
+
+    def info(self):
+        return self.headers
+
+    def read(self):
+        return self.body
+
+
+class ConnectionPool:
+    """Persistent connections, shared by every thread fetching pages.
+
+    No more than `size' connections are in use at once; other requests wait
+    for one to come free. Idle connections are kept per host and reused.
+    Each request gives up after `timeout' seconds without data. Timings of
+    recent requests are kept in `stats', as (url, status, bytes, reused
+    connection, seconds).
+    """
+    def __init__(self, size=HTTP_POOL_SIZE, timeout=HTTP_TIMEOUT):
+        self.timeout = timeout
+        self.slots = threading.BoundedSemaphore(size)
+        self.lock = threading.Lock()
+        self.idle = {}      # (scheme, host, port) -> [connection, ...]
+        self.stats = collections.deque(maxlen=HTTP_STATS)
+
+    def connect(self, key, fresh=False):
+        """Return (connection, reused) for a host, reusing one if possible."""
+        with self.lock:
+            conns = self.idle.get(key)
+            if conns and not fresh:
+                return conns.pop(), True
+        scheme, host, port = key
+        if scheme == 'https':
+            return httplib.HTTPSConnection(host, port,
+                                           timeout=self.timeout), False
+        return httplib.HTTPConnection(host, port, timeout=self.timeout), False
+
+    def keep(self, key, conn):
+        with self.lock:
+            self.idle.setdefault(key, []).append(conn)
+
+    def request(self, url, headers={}, sink=None, redirects=HTTP_REDIRECTS):
+        """GET `url', following redirects, and return a `Response'.
+
+        If `sink' is given, a successful response's body is handed to it as
+        it arrives instead of being kept: first `sink.begin(headers)', then
+        `sink.feed(chunk)' for each chunk, until `feed' returns True to stop
+        the download early. Raise httplib.HTTPException or socket.error on
+        failure.
+        """
+        for _ in xrange(redirects + 1):
+            response = self.fetch(url, headers, sink)
+            location = response.headers.get('Location')
+            if response.status not in REDIRECTS or location is None:
+                return response
+            url = urlparse.urljoin(url, location)
+        raise httplib.HTTPException('Too many redirects: ' + url)
+
+    def fetch(self, url, headers, sink=None):
+        """GET `url' once, without following redirects."""
+        parts = urlparse.urlsplit(url)
+        port = parts.port or (443 if parts.scheme == 'https' else 80)
+        key = (parts.scheme, parts.hostname, port)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        with self.slots:
+            start = time.time()
+            conn, reused = self.connect(key)
+            try:
+                resp = send(conn, path, headers)
+            except (httplib.HTTPException, socket.error):
+                if not reused:
+                    raise
+                # The server may have dropped an idle connection; try again
+                # on a fresh one. Nothing has reached `sink' yet.
+                conn, reused = self.connect(key, fresh=True)
+                resp = send(conn, path, headers)
+            body, size, complete = receive(conn, resp, sink)
+            if resp.will_close or not complete:
+                conn.close()
+            else:
+                self.keep(key, conn)
+            self.stats.append((url, resp.status, size, reused,
+                               time.time() - start))
+        return Response(url, resp.status, resp.msg, body)
+
+
+def send(conn, path, headers):
+    """Make one GET request on `conn'. Return the response, headers read.
+
+    The connection is closed if anything goes wrong.
+    """
+    try:
+        conn.request('GET', path, headers=headers)
+        return conn.getresponse()
+    except (httplib.HTTPException, socket.error):
+        conn.close()
+        raise
+
+def receive(conn, resp, sink=None):
+    """Read the body of `resp', from `send' on `conn'.
+
+    Return the body (None if streamed to `sink'), the number of bytes read,
+    and whether the whole body was read. The connection is closed if
+    anything goes wrong, including `sink' failing.
+    """
+    try:
+        if sink is None or resp.status != 200:
+            body = resp.read()
+            return body, len(body), True
+        sink.begin(resp.msg)
+        size = 0
+        while True:
+            chunk = resp.read(HTTP_CHUNK)
+            if not chunk:
+                return None, size, True
+            size += len(chunk)
+            if sink.feed(chunk):
+                return None, size, False
+    except Exception:
+        conn.close()
+        raise
+
+
+POOL = ConnectionPool()
@@ -0,0 +1,173 @@
+"""On-disk cache of laid out pages, so that known HTML is never parsed twice.
+"""
+# Copyright 2013 Aaron Graham-Horowitz
+#
+# This file is part of Escape from Wikipedia.
+#
+# Escape from Wikipedia is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or any later version.
+#
+# Escape from Wikipedia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os, struct, zlib, hashlib, threading
+from constants import *
+
+MAGIC = 'EFWL'
+HEADER = struct.Struct('<4sHIII')   # magic, version, strings, lines, words
+# text index, link index, left, bottom, attr, size, red, green, blue, ff
+WORD = struct.Struct('<IIffBBBBBd')
+
+def layoutKey(html_doc):
+    """Return the cache key for a page's HTML under the current layout code.
+
+    The parser is part of the key, as different parsers build different trees.
+    """
+    return '%s-%d-%s' % (hashlib.sha1(html_doc).hexdigest(), LAYOUT_VERSION,
+                         PARSER)
+
+def pack(title, records, lines):
+    """Encode a laid out page as a compact, compressed string.
+
+    `records' holds one tuple per word:
+    (text, link, left, bottom, attr, size, color, ff).
+    """
+    strings = [title]
+    index = {title: 0}
+    packed = []
+    for text, link, left, bottom, attr, size, color, ff in records:
+        for s in (text, link):
+            if s not in index:
+                index[s] = len(strings)
+                strings.append(s)
+        packed.append(WORD.pack(index[text], index[link], left, bottom,
+                                attr, size, color[0], color[1], color[2], ff))
+    encoded = [s.encode('utf-8') if isinstance(s, unicode) else s
+               for s in strings]
+    data = [HEADER.pack(MAGIC, LAYOUT_VERSION, len(strings), len(lines),
+                        len(records))]
+    data.append(struct.pack('<%dI' % len(encoded),
+                            *[len(s) for s in encoded]))
+    data.extend(encoded)
+    data.append(struct.pack('<%df' % len(lines), *lines))
+    data.extend(packed)
+    return zlib.compress(''.join(data))
+
+def unpack(data):
+    """Decode a string from `pack'. Return (title, records, lines).
+
+    `records' is a `PackedRecords', so words are only decoded as they are
+    read.
+    """
+    data = zlib.decompress(data)
+    magic, version, n_strings, n_lines, n_words = HEADER.unpack_from(data)
+    if magic != MAGIC or version != LAYOUT_VERSION:
+        raise ValueError('Not a current layout record')
+    offset = HEADER.size
+    lengths = struct.unpack_from('<%dI' % n_strings, data, offset)
+    offset += 4 * n_strings
+    strings = []
+    for n in lengths:
+        strings.append(data[offset:offset + n].decode('utf-8'))
+        offset += n
+    lines = list(struct.unpack_from('<%df' % n_lines, data, offset))
+    offset += 4 * n_lines
+    if len(data) < offset + n_words * WORD.size:
+        raise ValueError('Truncated layout record')
+    records = PackedRecords(data, offset, n_words, strings)
+    return strings[0].encode('ascii', 'replace'), records, lines
+
+
+class PackedRecords:
+    """The word records of a page from `unpack', as a read-only sequence.
+
+    Each record is decoded from the packed data whenever it is read.
+    """
+    def __init__(self, data, offset, count, strings):
+        self.data = data
+        self.offset = offset
+        self.count = count
+        self.strings = strings
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in xrange(*i.indices(self.count))]
+        if i < 0:
+            i += self.count
+        if not 0 <= i < self.count:
+            raise IndexError('record index out of range')
+        (text, link, left, bottom, attr, size, r, g, b,
+                ff) = WORD.unpack_from(self.data, self.offset + i * WORD.size)
+        return (self.strings[text], self.strings[link], left, bottom, attr,
+                size, (r, g, b), ff)
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+
+class LayoutCache:
+    """Packed layouts stored one per file, named by `layoutKey'.
+
+    When the files take up more than `limit' bytes, the least recently used
+    are deleted. Shared by all threads.
+    """
+    def __init__(self, directory=os.path.join(CACHE_DIR, 'layout'),
+                 limit=LAYOUT_CACHE_LIMIT):
+        self.directory = directory
+        self.limit = limit
+        self.lock = threading.Lock()
+
+    def load(self, key):
+        """Return (title, records, lines) stored under `key', or None."""
+        path = os.path.join(self.directory, key)
+        with self.lock:
+            try:
+                with open(path, 'rb') as f:
+                    data = f.read()
+                os.utime(path, None)    # Mark as recently used
+            except (IOError, OSError):
+                return None
+        try:
+            return unpack(data)
+        except (ValueError, struct.error, zlib.error):
+            return None
+
+    def save(self, key, title, records, lines):
+        self.write(key, pack(title, records, lines))
+
+    def write(self, key, data):
+        """Store a layout already packed by `pack'."""
+        with self.lock:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            with open(os.path.join(self.directory, key), 'wb') as f:
+                f.write(data)
+            self.evict()
+
+    def evict(self):
+        """Delete least recently used layouts until within the size limit."""
+        files = []
+        for name in os.listdir(self.directory):
+            st = os.stat(os.path.join(self.directory, name))
+            files.append((st.st_mtime, st.st_size, name))
+        files.sort()
+        total = sum(f[1] for f in files)
+        while total > self.limit and files:
+            _, size, name = files.pop(0)
+            total -= size
+            os.remove(os.path.join(self.directory, name))
+
+
+CACHE = LayoutCache()
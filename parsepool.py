@@ -0,0 +1,155 @@
+"""Laying out pages in worker processes, away from the game loop.
+
+Parsing and laying out a page is pure Python, so on a thread it would still
+hold up the game loop through the GIL. A `ParsePool' does it in other
+processes instead, and hands back only the laid out page: what `getSource'
+returns as `layout'. While `TRACER' is enabled, workers trace each page too,
+and their spans are added to it.
+"""
+# Copyright 2013 Aaron Graham-Horowitz
+#
+# This file is part of Escape from Wikipedia.
+#
+# Escape from Wikipedia is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or any later version.
+#
+# Escape from Wikipedia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import multiprocessing, threading, Queue, timeit, pygame
+from constants import *
+import layoutcache
+from tracing import TRACER
+from scrapewiki import getSoup, getWords, loadFonts, HTML404
+
+def layoutHTML(html_doc):
+    """Lay out a page. Return it packed by `layoutcache.pack'."""
+    title, words, lines = getWords(getSoup(html_doc))
+    return layoutcache.pack(title, [w.record() for w in words], lines)
+
+def work(conn):
+    """Lay out each page sent down `conn', and send it back packed.
+
+    Pages come with whether to trace them, and go back with the spans
+    traced, from `Tracer.take'. None is sent back for a page that can't be
+    laid out.
+    """
+    pygame.font.init()
+    try:
+        # Get the slow parts over with while the first page is fetched
+        loadFonts()
+        getSoup('')
+    except Exception:
+        pass    # Left to fail on the first page
+    TRACER.take(0)  # Any spans inherited from the parent process
+    while True:
+        try:
+            html_doc, traced = conn.recv()
+        except EOFError:
+            return
+        start = timeit.default_timer()
+        TRACER.enabled = traced
+        try:
+            data = layoutHTML(html_doc)
+        except Exception:
+            data = None
+        conn.send((data, TRACER.take(start)))
+
+
+class Worker:
+    """A process running `work', with its own pipe."""
+    def __init__(self):
+        self.conn, child = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=work, args=(child, ))
+        self.process.daemon = True
+        self.process.start()
+        child.close()
+
+    def stop(self):
+        self.process.terminate()
+        self.conn.close()
+
+
+class ParsePool:
+    """Processes laying out pages for `getSource'. Shared by all threads.
+
+    Each worker has a pipe of its own, so one that takes longer than
+    `timeout' seconds over a page, or dies, is simply replaced by one of
+    `spares'. Those are started along with the rest, as starting a process
+    once the game has threads running could copy a lock held by one of them
+    and hang. Once the spares run out, the pool carries on with fewer
+    workers, and with none every page is the error page.
+    """
+    def __init__(self, workers=PARSE_WORKERS, spares=PARSE_SPARES,
+                 timeout=PARSE_TIMEOUT):
+        self.timeout = timeout
+        self.idle = Queue.Queue()    # Workers, or None once there are none
+        self.workers = workers
+        self.spares = [Worker() for _ in xrange(spares)]
+        self.lock = threading.Lock()
+        for _ in xrange(workers):
+            self.idle.put(Worker())
+
+    def layout(self, url, html_doc):
+        """Lay out `html_doc', fetched from `url'.
+
+        Return (html_doc, packed, layout), where `layout' is `packed'
+        unpacked: exactly what a later `layoutcache' hit for the page
+        returns. If that fails, the error page is laid out here instead and
+        returned as `html_doc', with `packed' None, as it is not worth
+        caching.
+        """
+        worker = self.idle.get()
+        data = None
+        if worker is None:
+            self.idle.put(None)     # For the next thread waiting
+        else:
+            healthy = False
+            try:
+                start = timeit.default_timer()
+                worker.conn.send((html_doc, TRACER.enabled))
+                if worker.conn.poll(self.timeout):
+                    data, events = worker.conn.recv()
+                    TRACER.merge(events, start, url=url)
+                    healthy = True
+            except (EOFError, IOError):
+                pass    # Died
+            if healthy:
+                self.idle.put(worker)
+            else:
+                worker.stop()
+                self.replace()
+        if data is None:
+            html_doc = HTML404.format(url)
+            return html_doc, None, layoutcache.unpack(layoutHTML(html_doc))
+        return html_doc, data, layoutcache.unpack(data)
+
+    def replace(self):
+        """Put a spare in place of a stopped worker, if there is one left."""
+        with self.lock:
+            if self.spares:
+                self.idle.put(self.spares.pop())
+                return
+            self.workers -= 1
+            if self.workers == 0:
+                self.idle.put(None)
+
+    def close(self):
+        """Stop the workers not busy. Busy ones stop with the game."""
+        with self.lock:
+            spares, self.spares = self.spares, []
+        for worker in spares:
+            worker.stop()
+        while True:
+            try:
+                worker = self.idle.get_nowait()
+            except Queue.Empty:
+                return
+            if worker is not None:
+                worker.stop()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+"""Check that every HTML parser backend lays out saved pages identically.
+
+Usage: parsercheck.py [page.html ...]
+
+Each page (by default every fixtures/*.html and pages/*.html) is laid out
+with the `html.parser' backend, which is always installed, and then with
+each other installed backend in `scrapewiki.PARSERS'. Their Words are
+compared in the same run, so the fonts used don't matter. Time taken by
+each backend is reported. The check fails if there are no pages, or no
+other backend to compare with.
+"""
+# Copyright 2013 Aaron Graham-Horowitz
+#
+# This file is part of Escape from Wikipedia.
+#
+# Escape from Wikipedia is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or any later version.
+#
+# Escape from Wikipedia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import sys, os, glob, time, argparse, pygame, bs4
+from constants import *
+import glutils
+from scrapewiki import getSoup, getWords, PARSERS
+
+REFERENCE_PARSER = 'html.parser'
+
+def layout(html_doc, parser):
+    """Return (title, records, lines) for a page, and seconds taken."""
+    start = time.time()
+    title, words, lines = getWords(getSoup(html_doc, parser))
+    elapsed = time.time() - start
+    records = [w.record() for w in words]
+    return (title, records, lines), elapsed
+
+def difference(expected, result):
+    """Describe the first difference between two layouts, or return None."""
+    if expected[0] != result[0]:
+        return 'title %r, not %r' % (result[0], expected[0])
+    for i, (a, b) in enumerate(zip(expected[1], result[1])):
+        if a != b:
+            return 'word %d is %r, not %r' % (i, b, a)
+    if len(expected[1]) != len(result[1]):
+        return '%d words, not %d' % (len(result[1]), len(expected[1]))
+    if expected[2] != result[2]:
+        return 'rules at %r, not %r' % (result[2], expected[2])
+    return None
+
+def installed():
+    """Return the names of the parser backends that can be used here."""
+    names = []
+    for name in sorted(PARSERS):
+        try:
+            getSoup('<html></html>', name)
+            names.append(name)
+        except bs4.FeatureNotFound:
+            pass
+    return names
+
+def main():
+    argparser = argparse.ArgumentParser(
+            description='Compare HTML parser backends on saved pages.')
+    argparser.add_argument('pages', nargs='*',
+            default=sorted(glob.glob(os.path.join('fixtures', '*.html')) +
+                           glob.glob(os.path.join('pages', '*.html'))))
+    args = argparser.parse_args()
+    if not args.pages:
+        sys.exit('No pages to check: save some to fixtures/, e.g. with '
+                 'benchmark.py --fetch')
+    parsers = [p for p in installed() if p != REFERENCE_PARSER]
+    if not parsers:
+        sys.exit('Only %s is installed: nothing to compare it with. Install '
+                 'lxml or html5lib.' % REFERENCE_PARSER)
+
+    glutils.setBackend('null')  # Layout needs no display
+    pygame.font.init()
+    failures = 0
+    for path in args.pages:
+        with open(path, 'rb') as f:
+            html_doc = f.read()
+        expected, elapsed = layout(html_doc, REFERENCE_PARSER)
+        print('%s: %-12s      %6d words  %.3fs' % (path, REFERENCE_PARSER,
+                len(expected[1]), elapsed))
+        for parser in parsers:
+            result, elapsed = layout(html_doc, parser)
+            diff = difference(expected, result)
+            if diff is not None:
+                failures += 1
+            print('%s: %-12s %-4s %6d words  %.3fs' % (path, parser,
+                    'ok' if diff is None else 'DIFF', len(result[1]),
+                    elapsed))
+            if diff is not None:
+                print('    ' + diff)
+    pygame.quit()
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
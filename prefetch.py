@@ -0,0 +1,142 @@
+"""Background fetching of pages the player is likely to visit next.
+"""
+# Copyright 2013 Aaron Graham-Horowitz
+#
+# This file is part of Escape from Wikipedia.
+#
+# Escape from Wikipedia is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or any later version.
+#
+# Escape from Wikipedia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import threading, Queue, collections, time
+from scrapewiki import getSource, getErrorSource, HTML404
+from constants import *
+
+class Job:
+    """A single url being fetched and parsed."""
+    def __init__(self, url):
+        self.url = url
+        self.source = None
+        self.cancelled = False
+        self.done = threading.Event()
+
+
+class RandomPages:
+    """Keeps up to `size' random pages fetched and parsed, ready to play.
+
+    A thread fetches another whenever there is room, laying it out in
+    `pool' if given.
+    """
+    def __init__(self, size=RANDOM_PAGES, pool=None, url=RANDOM_URL):
+        self.url = url
+        self.pool = pool
+        self.ready = Queue.Queue(size)
+        t = threading.Thread(target=self.work)
+        t.daemon = True
+        t.start()
+
+    def work(self):
+        while True:
+            try:
+                source = getSource(self.url, self.pool)
+            except Exception:
+                source = None   # e.g. a garbled response
+            if source is None or source[1] == HTML404.format(self.url):
+                time.sleep(RANDOM_RETRY)    # Offline, or Wikipedia is down
+                continue
+            self.ready.put(source)
+
+    def take(self):
+        """Return a ready page's `getSource' result, or None if none is ready.
+        """
+        try:
+            return self.ready.get_nowait()
+        except Queue.Empty:
+            return None
+
+
+class Prefetcher:
+    """Fetches and parses pages on worker threads before they are needed.
+
+    At most `slots' jobs are kept, queued, running or finished. Requesting
+    more cancels the oldest; a cancelled job that is already running finishes,
+    but its result is thrown away. Pages are laid out in `pool', a
+    `parsepool.ParsePool', if given. `random_pages' random pages are also
+    kept ready, for `poll' to hand out at once.
+    """
+    def __init__(self, slots=PREFETCH_SLOTS, workers=PREFETCH_WORKERS,
+                 pool=None, random_pages=RANDOM_PAGES):
+        self.slots = slots
+        self.pool = pool
+        self.randoms = None
+        if random_pages > 0:
+            self.randoms = RandomPages(random_pages, pool)
+        self.jobs = collections.OrderedDict()   # url -> Job, oldest first
+        self.lock = threading.Lock()
+        self.queue = Queue.Queue()
+        for _ in xrange(workers):
+            t = threading.Thread(target=self.work)
+            t.daemon = True
+            t.start()
+
+    def work(self):
+        while True:
+            job = self.queue.get()
+            if job.cancelled:
+                continue
+            try:
+                job.source = getSource(job.url, self.pool)
+            except Exception:
+                job.source = getErrorSource(job.url)   # Don't load forever
+            finally:
+                job.done.set()
+
+    def request(self, url):
+        """Start fetching `url', unless it is already wanted."""
+        with self.lock:
+            if url in self.jobs:
+                self.jobs[url] = self.jobs.pop(url)   # Now the newest
+                return
+            job = Job(url)
+            self.jobs[url] = job
+            while len(self.jobs) > self.slots:
+                _, stale = self.jobs.popitem(last=False)
+                stale.cancelled = True
+        self.queue.put(job)
+
+    def poll(self, url):
+        """Return `getSource' result for `url' if ready, or None if not yet.
+
+        Start fetching `url' if it is not already wanted. For RANDOM_URL, a
+        page kept ready is returned instead, if there is one and `url' was
+        not already being fetched.
+        """
+        if url == RANDOM_URL and self.randoms is not None:
+            with self.lock:
+                fetching = url in self.jobs
+            if not fetching:
+                source = self.randoms.take()
+                if source is not None:
+                    return source
+        self.request(url)
+        with self.lock:
+            job = self.jobs[url]
+            if not job.done.is_set():
+                return None
+            del self.jobs[url]
+        return job.source
+
+    def cancelAll(self):
+        """Drop every job, e.g. after leaving the page the links were on."""
+        with self.lock:
+            for job in self.jobs.itervalues():
+                job.cancelled = True
+            self.jobs.clear()
@@ -0,0 +1,217 @@
+"""Per-stage frame timing, shown over the game while it runs.
+"""
+# Copyright 2013 Aaron Graham-Horowitz
+#
+# This file is part of Escape from Wikipedia.
+#
+# Escape from Wikipedia is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or any later version.
+#
+# Escape from Wikipedia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import collections, csv, math, timeit, pygame
+from constants import *
+import glutils
+from sprites import MySprite
+
+# Stages of a frame, in the order the game loop reaches them
+PHASES = ('input', 'physics', 'collision', 'camera', 'layout', 'view',
+          'render', 'load', 'wait')
+GRAPH_WIDTH = 240
+GRAPH_HEIGHT = 60
+GRAPH_MS = 50.0         # Frame time at the top of the graph
+BUCKET_MIN_MS = 0.001   # Times kept for the summary, to within BUCKET_RATIO
+BUCKET_RATIO = 1.01
+BUCKETS = 2000          # Enough for 0.001 ms to over 400 s
+
+def percentile(values, p):
+    """Return the `p'th percentile of sorted `values'."""
+    if not values:
+        return 0.0
+    return values[int(p / 100.0 * (len(values) - 1))]
+
+
+class Timings:
+    """Running count, total, maximum and histogram of times in milliseconds.
+
+    Times are counted in buckets growing by BUCKET_RATIO, so percentiles can
+    be found to within that ratio without keeping every time.
+    """
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * BUCKETS
+
+    def add(self, ms):
+        self.count += 1
+        self.total += ms
+        self.max = max(self.max, ms)
+        if ms < BUCKET_MIN_MS:
+            i = 0
+        else:
+            i = min(BUCKETS - 1, 1 + int(math.log(ms / BUCKET_MIN_MS) /
+                                         math.log(BUCKET_RATIO)))
+        self.buckets[i] += 1
+
+    def percentile(self, p):
+        """Return roughly the `p'th percentile of the times."""
+        rank = int(p / 100.0 * (self.count - 1))
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen > rank:
+                return min(self.max, BUCKET_MIN_MS * BUCKET_RATIO ** i)
+        return self.max
+
+
+class Profiler:
+    """Times the stages of each frame while `enabled'.
+
+    The game calls `mark' as it finishes each of `PHASES', and `endFrame'
+    once per frame. The last PROFILE_HISTORY frames are kept in `recent',
+    and all of them are added up in `timings' for the summary. If `path' is
+    given, each frame's times are also written there as CSV as it ends.
+    While disabled, both calls return at once.
+    """
+    def __init__(self, enabled=False, target_ms=None, path=None):
+        self.enabled = enabled
+        self.target_ms = target_ms   # Frame time to draw a line at
+        self.count = 0
+        self.timings = dict((phase, Timings())
+                            for phase in PHASES + ('frame', ))
+        self.path = path
+        self.csv = None         # Open file at `path', once a frame ends
+        self.writer = None
+        self.recent = collections.deque(maxlen=PROFILE_HISTORY)
+        self.current = dict.fromkeys(PHASES, 0.0)
+        self.last = timeit.default_timer()
+        self.font = None
+        self.overlay = None
+        self.size = None
+        self.age = 0            # Frames since `overlay' was redrawn
+
+    def toggle(self):
+        self.enabled = not self.enabled
+        self.current = dict.fromkeys(PHASES, 0.0)
+        self.last = timeit.default_timer()
+        if not self.enabled:
+            self.release()
+
+    def mark(self, phase):
+        """Add the time since the last mark to `phase'."""
+        if not self.enabled:
+            return
+        now = timeit.default_timer()
+        self.current[phase] += now - self.last
+        self.last = now
+
+    def endFrame(self):
+        if not self.enabled:
+            return
+        frame = self.current
+        self.recent.append(frame)
+        total = 0.0
+        for phase in PHASES:
+            self.timings[phase].add(frame[phase] * 1000)
+            total += frame[phase]
+        self.timings['frame'].add(total * 1000)
+        if self.path is not None:
+            if self.writer is None:
+                self.csv = open(self.path, 'wb')
+                self.writer = csv.writer(self.csv)
+                self.writer.writerow(('frame',) + PHASES)
+            self.writer.writerow([self.count] + ['%.3f' % (frame[p] * 1000)
+                                                 for p in PHASES])
+        self.count += 1
+        self.current = dict.fromkeys(PHASES, 0.0)
+        self.age += 1
+
+    def summary(self):
+        """Return lines reporting milliseconds per frame for each phase."""
+        lines = ['%d frames' % self.count,
+                 '%-10s %9s %9s %9s %9s' % ('phase (ms)', 'total', 'mean',
+                                            '95%', 'max')]
+        for phase in PHASES + ('frame', ):
+            times = self.timings[phase]
+            if not times.count:
+                continue
+            lines.append('%-10s %9.1f %9.3f %9.3f %9.3f' % (phase,
+                    times.total, times.total / times.count,
+                    times.percentile(95), times.max))
+        return lines
+
+    def close(self):
+        """Finish writing the CSV, if any frames were timed."""
+        if self.csv is not None:
+            self.csv.close()
+            self.csv = None
+            self.writer = None
+
+    def render(self, camx, camy):
+        """Draw recent frame times in the top left of a screen at camx, camy.
+
+        The picture is only redrawn every PROFILE_REFRESH frames.
+        """
+        if not self.enabled:
+            return
+        if self.overlay is None or self.age >= PROFILE_REFRESH:
+            self.redraw()
+        self.overlay.xy = (camx - HALF_WINWIDTH + 10,
+                           camy + HALF_WINHEIGHT - 10 - self.size[1])
+        self.overlay.render()
+
+    def redraw(self):
+        self.age = 0
+        if self.font is None:
+            self.font = pygame.font.Font(None, 18)
+        totals = [sum(f.itervalues()) * 1000 for f in self.recent]
+        ordered = sorted(totals)
+        text = ['frame ms  50%% %.1f  95%% %.1f  99%% %.1f  max %.1f' % (
+                percentile(ordered, 50), percentile(ordered, 95),
+                percentile(ordered, 99), ordered[-1] if ordered else 0.0)]
+        n = max(1, len(self.recent))
+        text.extend('%-10s %6.2f' % (phase,
+                    sum(f[phase] for f in self.recent) * 1000 / n)
+                    for phase in PHASES)
+        count, size = glutils.textureStats()
+        text.append('textures %d  %.1f MB' % (count, size / 2.0 ** 20))
+        line_height = self.font.get_linesize()
+        width = GRAPH_WIDTH + 20
+        height = GRAPH_HEIGHT + 20 + line_height * len(text)
+        surf = pygame.Surface((width, height), pygame.SRCALPHA)
+        surf.fill((255, 255, 255, 210))
+        # One bar per frame, newest on the right
+        bottom = 10 + GRAPH_HEIGHT
+        x = 10 + GRAPH_WIDTH - len(totals)
+        for t in totals:
+            color = RED if self.target_ms and t > self.target_ms else GREEN
+            top = bottom - min(1.0, t / GRAPH_MS) * GRAPH_HEIGHT
+            pygame.draw.line(surf, color, (x, bottom), (x, top))
+            x += 1
+        if self.target_ms:
+            y = bottom - min(1.0, self.target_ms / GRAPH_MS) * GRAPH_HEIGHT
+            pygame.draw.line(surf, GRAY, (10, y), (10 + GRAPH_WIDTH, y))
+        for i, line in enumerate(text):
+            surf.blit(self.font.render(line, True, BLACK),
+                      (10, bottom + 10 + i * line_height))
+        if self.overlay is None or self.size != (width, height):
+            self.release()
+            self.size = (width, height)
+            tex_id = glutils.getBlankTexture(width, height)
+            self.overlay = MySprite(texture=tex_id,
+                                    shape=[0, height, width, 0])
+            self.overlay.owned_texture = tex_id
+        glutils.subTexture(self.overlay.texture, 0, 0, surf)
+
+    def release(self):
+        if self.overlay is not None:
+            self.overlay.release()
+            self.overlay = None
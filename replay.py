@@ -0,0 +1,187 @@
+"""Recording games as they are played, and replaying them exactly.
+
+A game reads its input, clock and pages through a session. `Session' is live
+play; `Recorder' is live play that also keeps everything read, and `Replay'
+hands the same things back in the same order, so that the game takes the
+same path again. Replays run as fast as they can and time each frame.
+"""
+# Copyright 2013 Aaron Graham-Horowitz
+#
+# This file is part of Escape from Wikipedia.
+#
+# Escape from Wikipedia is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or any later version.
+#
+# Escape from Wikipedia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json, zlib, base64, random
+import pygame
+from pygame.locals import *
+from constants import *
+import layoutcache, worldpack
+from parsepool import layoutHTML
+from profiler import Profiler
+
+TRACE_VERSION = 2
+EVENT_TYPES = {QUIT: 'quit', KEYDOWN: 'keydown', KEYUP: 'keyup'}
+
+class Session:
+    """Live play: input from pygame, pages from a `Prefetcher'.
+
+    Frames are timed by `profiler', which the game calls through `mark'.
+    """
+    seed = None     # Seed for the game's `random.Random'
+    render = True   # Whether frames are drawn
+
+    def __init__(self, profiler=None):
+        if profiler is None:
+            profiler = Profiler()
+        self.profiler = profiler
+        self.mark = profiler.mark
+
+    def events(self):
+        return pygame.event.get()
+
+    def ticks(self):
+        """Return the time in milliseconds."""
+        return pygame.time.get_ticks()
+
+    def source(self, url, prefetcher):
+        """Return `getSource' result for `url', or None if not ready yet."""
+        return prefetcher.poll(url)
+
+    def build(self, page):
+        """Lay out some more of an unfinished page."""
+        page.build(BUILD_BUDGET)
+
+    def toggleProfiler(self):
+        self.profiler.toggle()
+
+    def tick(self, fpsclock, fps):
+        """End the frame, waiting to keep to `fps' frames per second."""
+        fpsclock.tick(fps)
+        self.mark('wait')
+        self.profiler.endFrame()
+
+
+class Recorder(Session):
+    """Live play that keeps a trace of the game, to be saved with `save'.
+
+    Keys and the clock are kept as read, along with the HTML of every page
+    visited and how much of each page had been built when. Pages from a
+    world pack are kept as their url in the pack instead of their HTML.
+    """
+    def __init__(self, seed=None, profiler=None):
+        Session.__init__(self, profiler)
+        if seed is None:
+            seed = random.randrange(2 ** 32)
+        self.seed = seed
+        self.trace = {'version': TRACE_VERSION, 'seed': seed, 'events': [],
+                      'ticks': [], 'built': [], 'pages': []}
+
+    def events(self):
+        events = pygame.event.get()
+        self.trace['events'].append([(EVENT_TYPES[e.type],
+                                      getattr(e, 'key', None))
+                                     for e in events if e.type in EVENT_TYPES])
+        return events
+
+    def ticks(self):
+        ticks = pygame.time.get_ticks()
+        self.trace['ticks'].append(ticks)
+        return ticks
+
+    def source(self, url, prefetcher):
+        source = prefetcher.poll(url)
+        if source is not None:
+            key, html_doc = source[:2]
+            if html_doc is None:
+                self.trace['pages'].append((url, None, key))
+            else:
+                self.trace['pages'].append(
+                        (url, base64.b64encode(zlib.compress(html_doc))))
+        return source
+
+    def build(self, page):
+        page.build(BUILD_BUDGET)
+        # A finished page is kept as None, so the replay finishes it too
+        self.trace['built'].append(None if page.done else len(page.words))
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.trace, f)
+
+
+class Replay(Session):
+    """Plays back a trace saved by a `Recorder', optionally drawing it.
+
+    Pages are laid out again from the HTML in the trace, as a `ParsePool'
+    would, or loaded from the world pack they were recorded from, never
+    fetched. The game should start at `start', the first page recorded.
+    Every frame is timed by `profiler', which writes the times to `timings'
+    as CSV if given. Once the trace runs out, the game is told to quit.
+    """
+    def __init__(self, path, render=False, timings=None):
+        Session.__init__(self, Profiler(enabled=True, path=timings))
+        with open(path) as f:
+            trace = json.load(f)
+        if trace.get('version') != TRACE_VERSION:
+            raise ValueError('Unsupported trace version')
+        self.seed = trace['seed']
+        self.render = render
+        self.event_log = trace['events']
+        self.tick_log = trace['ticks']
+        self.built_log = trace['built']
+        self.pages = trace['pages']
+        self.start = self.pages[0][0] if self.pages else RANDOM_URL
+        self.now = 0
+
+    def events(self):
+        if not self.event_log:
+            return [pygame.event.Event(QUIT)]
+        types = dict((name, t) for t, name in EVENT_TYPES.iteritems())
+        return [pygame.event.Event(types[name], key=key)
+                for name, key in self.event_log.pop(0)]
+
+    def ticks(self):
+        if self.tick_log:
+            self.now = self.tick_log.pop(0)
+        return self.now
+
+    def source(self, url, prefetcher):
+        if not self.pages:
+            raise ValueError('Replay visited more pages than were recorded')
+        recorded = self.pages.pop(0)
+        recorded_url, data = recorded[:2]
+        if recorded_url != url:
+            raise ValueError('Replay went to %s instead of %s' %
+                             (url, recorded_url))
+        if data is None:
+            found = None
+            if worldpack.WORLD is not None:
+                found = worldpack.WORLD.load(recorded[2])
+            if found is None:
+                raise ValueError('Replay needs the world pack with %s' %
+                                 recorded[2])
+            key, layout = found
+            return key, None, None, layout
+        html_doc = zlib.decompress(base64.b64decode(data))
+        key = layoutcache.layoutKey(html_doc)
+        return key, html_doc, None, layoutcache.unpack(layoutHTML(html_doc))
+
+    def build(self, page):
+        words = self.built_log.pop(0) if self.built_log else None
+        page.build(words=words)
+
+    def toggleProfiler(self):
+        pass    # Replays are always timed
+
+    def tick(self, fpsclock, fps):
+        self.profiler.endFrame()   # No waiting
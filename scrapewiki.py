@@ -1,7 +1,7 @@
 """Functions and classes for generating `Word' and `Page' objects from the web.
 
 All functions are intended to be private. Other modules should import only
-`Page' and `Word' as necessary.
+`Page', `Word' and `Label' as necessary.
 """
 # Copyright 2013 Aaron Graham-Horowitz
 # 
@@ -22,12 +22,21 @@ All functions are intended to be private. Other modules should import only
 # TODO: Continue to improve parsing. Spaces appearing near parenthesis and
 # apostrophes is still an issue.
 
-import urllib2, StringIO, gzip, zlib, bs4, re, pygame, os
-import glutils
+import httplib, socket, zlib, re, os, time, threading
+import pygame, rabbyt
+from atlas import TextureAtlas
+from wordstore import WordStore
+from batch import QuadBatch
+import httpcache, httpclient, layoutcache, worldpack
+from tracing import TRACER, traced
+from httpcache import isVolatile
 from sprites import MySprite
 from constants import *
-# lxml is not necessary, as parsing is not currently a bottleneck.
-#import lxml
+# Parser backends for bs4, by name: either a bs4 feature string, or a bs4
+# TreeBuilder class for a custom parser. lxml and html5lib are optional.
+PARSERS = {'html.parser' : 'html.parser',
+           'lxml' : 'lxml',
+           'html5lib' : 'html5lib'}
 
 BULLET = 0x2022   # Unicode character
 
@@ -36,74 +45,150 @@ ZERO_WIDTH = re.compile(u'\ufeff')
 
 HTML404 = """<html><head><title>ERROR: The requested URL could not be retrieved</title> </head> <body><h2>ERROR</h2> <h2>The requested URL could not be retrieved</h2> <p>While trying to retrieve the URL:<a href="{0}">{0}</a> </p> <p>The following error was encountered: <strong>Connection to Wikipedia Failed</strong> </p> <p>The system returned: <i>(101) Network is unreachable</i> </p> <p>The remote host or network may be down.  Please try the request again.</p> <p>Your cache administrator is DEAD.</p> </body> </html>"""
 
+# Font files by attribute, in fonts/
+FONT_FILES = {REGULAR : 'arial.ttf', BOLD : 'arialbd.ttf',
+              ITALIC : 'ariali.ttf', BOLDITAL : 'arialbi.ttf'}
+FONT_LOCK = threading.Lock()
+
 def fontCheck(attr):
-    """Load font files only when needed, and only once each."""
-    if Word.WIKIFONT[attr] == None:
-        if attr == REGULAR:
-            Word.WIKI_REGULAR = [pygame.font.Font(os.path.join('fonts', 'arial.ttf'),
-                                                  SMALL_FONT_SIZE),
-                                 pygame.font.Font(os.path.join('fonts', 'arial.ttf'),
-                                                  MEDIUM_FONT_SIZE),
-                                 pygame.font.Font(os.path.join('fonts', 'arial.ttf'),
-                                                  LARGE_FONT_SIZE)]
-        elif attr == BOLD:
-            Word.WIKI_BOLD = [pygame.font.Font(os.path.join('fonts', 'arialbd.ttf'),
-                                               SMALL_FONT_SIZE),
-                              pygame.font.Font(os.path.join('fonts', 'arialbd.ttf'),
-                                               MEDIUM_FONT_SIZE),
-                              pygame.font.Font(os.path.join('fonts', 'arialbd.ttf'),
-                                               LARGE_FONT_SIZE)]
-        elif attr == ITALIC:
-            Word.WIKI_ITALIC = [pygame.font.Font(os.path.join('fonts', 'ariali.ttf'),
-                                                 SMALL_FONT_SIZE),
-                                pygame.font.Font(os.path.join('fonts', 'ariali.ttf'),
-                                                 MEDIUM_FONT_SIZE),
-                                pygame.font.Font(os.path.join('fonts', 'ariali.ttf'),
-                                                 LARGE_FONT_SIZE)]
-        elif attr == BOLDITAL:
-            Word.WIKI_BOLDITAL = [pygame.font.Font(os.path.join('fonts', 'arialbi.ttf'),
-                                                   SMALL_FONT_SIZE),
-                                  pygame.font.Font(os.path.join('fonts', 'arialbi.ttf'),
-                                                   MEDIUM_FONT_SIZE),
-                                  pygame.font.Font(os.path.join('fonts', 'arialbi.ttf'),
-                                                   LARGE_FONT_SIZE)]
-        Word.WIKIFONT = {REGULAR : Word.WIKI_REGULAR,
-                         BOLD : Word.WIKI_BOLD,
-                         ITALIC : Word.WIKI_ITALIC,
-                         BOLDITAL : Word.WIKI_BOLDITAL}
-
-def decode(page):
-    """Some Wikipedia pages are fetched compressed. This undoes that."""
-    encoding = page.info().get("Content-Encoding")
-    if encoding in ('gzip', 'x-gzip', 'deflate'):
-        content = page.read()
-        if encoding == 'deflate':
-            data = StringIO.StringIO(zlib.decompress(content))
-        else:
-            data = gzip.GzipFile('', 'rb', 9, StringIO.StringIO(content))
-        page = data.read()
-    return page
+    """Load font files only when needed, and only once each.
+
+    Safe to call off the main thread.
+    """
+    if Word.WIKIFONT[attr] is None:
+        with FONT_LOCK:
+            if Word.WIKIFONT[attr] is None:     # Not loaded while waiting
+                path = os.path.join('fonts', FONT_FILES[attr])
+                Word.WIKIFONT[attr] = [pygame.font.Font(path, size)
+                                       for size in (SMALL_FONT_SIZE,
+                                                    MEDIUM_FONT_SIZE,
+                                                    LARGE_FONT_SIZE)]
+
+def loadFonts():
+    """Load every font now, rather than when first needed."""
+    for attr in FONT_FILES:
+        fontCheck(attr)
+
+def preloadFonts():
+    """Start loading every font in the background, before words need them.
+
+    A font that fails to load is left for the first word needing it to
+    report.
+    """
+    def load():
+        try:
+            loadFonts()
+        except (IOError, pygame.error):
+            pass
+    thread = threading.Thread(target=load)
+    thread.daemon = True
+    thread.start()
+
+class PageDecoder:
+    """Decompresses a page as it arrives, and spots where to stop reading.
+
+    Reading stops at the end of the heading of section `cutoff', as nothing
+    from there on is laid out. Use as a `sink' for `httpclient'.
+    """
+    def __init__(self, cutoff=CUTOFF_SECTION):
+        self.marker = None
+        if cutoff is not None:
+            self.marker = re.compile('id="%s"' % re.escape(cutoff))
+        self.inflater = None
+        self.parts = []
+        self.length = 0     # Bytes decoded so far
+        self.tail = ''      # End of decoded text, to find split markers
+        self.found = None   # Offset just past the cutoff marker
+        self.cut = None     # Offset to cut the page at
+
+    def begin(self, headers):
+        """Some Wikipedia pages are fetched compressed. Prepare to undo that."""
+        encoding = headers.get("Content-Encoding")
+        if encoding in ('gzip', 'x-gzip'):
+            self.inflater = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif encoding == 'deflate':
+            self.inflater = zlib.decompressobj()
+
+    def feed(self, chunk):
+        """Take the next chunk of the page. Return True once past the cutoff."""
+        with TRACER.span('decode', bytes=len(chunk)):
+            return self.scan(chunk)
+
+    def scan(self, chunk):
+        if self.inflater is not None:
+            chunk = self.inflater.decompress(chunk)
+        window = self.tail + chunk
+        base = self.length - len(self.tail)
+        self.parts.append(chunk)
+        self.length += len(chunk)
+        if self.marker is not None and self.found is None:
+            m = self.marker.search(window)
+            if m is not None:
+                self.found = base + m.end()
+        if self.found is not None:
+            i = window.find('</h2>', max(0, self.found - base))
+            if i >= 0:
+                self.cut = base + i + len('</h2>')
+                return True
+        self.tail = window[-DECODE_WINDOW:]
+        return False
+
+    def result(self):
+        """Return the page, decompressed and cut short."""
+        if self.inflater is not None and self.cut is None:
+            self.parts.append(self.inflater.flush())
+        return ''.join(self.parts)[:self.cut]
 
 def getHTML(addr):
-    """Return html for webpage 'addr', or error page on failed connection."""
+    """Return html for webpage 'addr', or error page on failed connection.
+
+    Pages are decompressed as they arrive, and the download stops at the
+    cutoff section. They are kept in the disk cache, and revalidated rather
+    than refetched. When the network is down, cached copies are served, however old.
+    A page bundled with the game, given as a path, is read from disk.
+    """
+    if '://' not in addr:
+        with open(addr, 'rb') as f:
+            return f.read()
+    cache = httpcache.CACHE
+    validators = cache.lookup(addr)
+    headers = {'User-Agent': 'Magic Browser',
+               'Accept-Encoding': 'gzip,deflate'}
+    if validators is not None:
+        etag, modified = validators
+        if etag is not None:
+            headers['If-None-Match'] = etag
+        if modified is not None:
+            headers['If-Modified-Since'] = modified
+    decoder = PageDecoder()
     try:
-        opener = urllib2.build_opener()
-        opener.addheaders = [('User-Agent', 'Magic Browser'),
-                ('Accept-Encoding', 'gzip,deflate')]
-        usock = opener.open(addr)
-        url = usock.geturl()
-        html_doc = decode(usock)
-        usock.close()
-        return html_doc
-    except (urllib2.URLError, BadStatusLine):
+        with TRACER.span('fetch') as span:
+            response = httpclient.POOL.request(addr, headers, decoder)
+            span.args['bytes'] = decoder.length
+    except (httplib.HTTPException, socket.error, ValueError, zlib.error):
+        # Offline, or the page arrived garbled: anything we have is better
+        # than nothing
+        if isVolatile(addr):
+            html_doc = cache.readAny()
+        else:
+            html_doc = cache.read(addr)
+        if html_doc is not None:
+            return html_doc
+        return HTML404.format(addr)
+    if response.status == 304:   # Not Modified
+        html_doc = cache.read(addr)
+        if html_doc is not None:
+            return html_doc
+    if response.status != 200:
         return HTML404.format(addr)
+    html_doc = decoder.result()
+    cache.store(addr, response.geturl(), html_doc,
+                response.info().get('ETag'),
+                response.info().get('Last-Modified'))
+    return html_doc
 
-def getWords(html_doc):
-    """Return all `Word's in an HTML string, with formatting.
-    
-    Return page title and horizontal rule locations as well.
-    First step in recursive parsing process.
-    """
+def cleanHTML(html_doc):
+    """Strip and rearrange an HTML string so that it lays out well."""
     # Get rid of tags that won't be used
     pattern = re.compile('<table.*?</table>', re.DOTALL)
     html_doc = pattern.sub('', html_doc)
@@ -115,9 +200,93 @@ def getWords(html_doc):
     html_doc = pattern.sub(repl, html_doc)
     pattern = re.compile('(</\S+>)([.,;")\]]+)')
     html_doc = pattern.sub(repl, html_doc)
+    return html_doc
+
+def getSoup(html_doc, parser=PARSER):
+    """Clean up an HTML string and parse it. Safe to call off the main thread.
+
+    `parser' names one of `PARSERS', or is None to let bs4 pick the best
+    parser installed.
+    """
+    with TRACER.span('clean', bytes=len(html_doc)):
+        html_doc = cleanHTML(html_doc)
+    with TRACER.span('parse', bytes=len(html_doc)):
+        return parseHTML(html_doc, parser)
+
+def parseHTML(html_doc, parser=PARSER):
+    """Parse an HTML string already cleaned up by `cleanHTML'."""
+    # Slow to import, and the game itself leaves parsing to a `ParsePool'
+    import bs4
+    if parser is None:
+        return bs4.BeautifulSoup(html_doc, from_encoding="utf-8")
+    features = PARSERS[parser]
+    if isinstance(features, basestring):
+        return bs4.BeautifulSoup(html_doc, features, from_encoding="utf-8")
+    return bs4.BeautifulSoup(html_doc, builder=features(),
+                             from_encoding="utf-8")
+
+def getSource(url, pool=None):
+    """Fetch `url' and prepare it for layout. Safe to call off the main thread.
+
+    Return (key, html_doc, soup, layout), where `key' is the page's
+    `layoutcache' key. If the page has been laid out before, `layout' is the
+    cached (title, records, lines) and `soup' is None; otherwise `layout' is
+    None. Pages in the open world pack, if any, are never fetched: `key' is
+    then the page's url in the pack, and `html_doc' is None.
+
+    Given a `parsepool.ParsePool', pages are always laid out in the pool,
+    so `layout' is never None.
+    """
+    with TRACER.span('getSource', url=url):
+        if worldpack.WORLD is not None:
+            with TRACER.span('worldpack'):
+                found = worldpack.WORLD.load(url)
+            if found is not None:
+                key, layout = found
+                return key, None, None, layout
+        with TRACER.span('getHTML') as span:
+            html_doc = getHTML(url)
+            span.args['bytes'] = len(html_doc)
+        key = layoutcache.layoutKey(html_doc)
+        with TRACER.span('layoutcache'):
+            layout = layoutcache.CACHE.load(key)
+        if layout is not None:
+            return key, html_doc, None, layout
+        if pool is None:
+            return key, html_doc, getSoup(html_doc), None
+        with TRACER.span('parsepool', bytes=len(html_doc)):
+            html_doc, data, layout = pool.layout(url, html_doc)
+        if data is not None:
+            layoutcache.CACHE.write(key, data)
+        return key, html_doc, None, layout
+
+def getErrorSource(url):
+    """Return a `getSource' result for the error page, for when `url' fails.
+    """
+    html_doc = HTML404.format(url)
+    return layoutcache.layoutKey(html_doc), html_doc, getSoup(html_doc), None
+
+def getWords(soup):
+    """Return all `Word's in a soup from `getSoup', with formatting.
+    
+    Return page title and horizontal rule locations as well.
+    """
+    words, lines = [], []
+    for new_words, new_lines in layoutWords(soup):
+        words.extend(new_words)
+        lines.extend(new_lines)
+    return getTitle(soup), words, lines
+
+def getTitle(soup):
+    """Return page title, formatted for caption display."""
+    return getStr(soup.title).encode('ascii', 'replace')
 
-    soup = bs4.BeautifulSoup(html_doc, from_encoding="utf-8")
-    #soup = bs4.BeautifulSoup(html_doc, "lxml", from_encoding="utf-8")
+def layoutWords(soup):
+    """Generate `Word's of a page, one block at a time, from the top down.
+
+    Each block is a pair: a list of `Word's and a list of horizontal rule
+    locations. First step in recursive parsing process.
+    """
     y = 0
     # Get page title
     title = getStr(soup.title)
@@ -128,36 +297,51 @@ def getWords(html_doc):
     # Pretty sure this doesn't happen anymore, but can't hurt to check.
     if (words == []):
         words, _, _ = strToWords("Title Not Found", y, size=1, color=RED)
-    lines = [words[-1].bottom - LINE_PADDING]
-    y = words[-1].bottom - VSPACE
+    yield words, [words[-1].bottom - LINE_PADDING]
+    last = words[-1]
+    y = last.bottom - VSPACE
     new_words, _, _ = strToWords("From Wikipedia, the free encyclopedia", y,
             color=GRAY)
     for w in new_words:
         w.ff = SLIPPERY     # Just for kicks
-    words.extend(new_words)
+    yield new_words, []
+    last = new_words[-1]
     # Find relevant text-containing elements
     for tag in soup.body.find_all(['h2', 'dt', 'p', 'ul']):
         new_words = []
-        y = words[-1].bottom - PARSPACE
+        lines = []
+        y = last.bottom - PARSPACE
         if tag.name == u'h2':
             new_words, _, _ = strToWords(getStr(tag), y, size=1)
-            lines.append(new_words[-1].bottom - LINE_PADDING)
+            if new_words:
+                lines.append(new_words[-1].bottom - LINE_PADDING)
         elif tag.name == u'dt':
             new_words, _, _ = strToWords(getStr(tag), y + PARSPACE / 2, attr=BOLD)
         elif tag.name == u'p':
             new_words, _, _ = getParWords(tag, y)
         elif tag.name == u'ul':
             new_words, _, _ = getParWords(tag, y + PARSPACE)
-        words.extend(new_words)
-        if tag.name == u'h2' and words[-1].text == u'References':
+        yield new_words, lines
+        if new_words:
+            last = new_words[-1]
+        if tag.name == u'h2' and last.text == u'References':
             break # That's as far down as we go
-    # Reformat title for caption display
-    return title.encode('ascii', 'replace') , words, lines
+
+def recordWords(records, lines):
+    """Generate `Word's from cached records, in blocks like `layoutWords'."""
+    for i in xrange(0, len(records), RECORD_BLOCK):
+        words = []
+        for text, link, left, bottom, attr, size, color, ff in (
+                records[i:i + RECORD_BLOCK]):
+            w = Word(text, (left, bottom), attr, size, link, color, color)
+            w.ff = ff
+            words.append(w)
+        yield words, lines if i == 0 else []
 
 def getStr(tag):
     """Strips away `div' and `span' tags obscuring text."""
     for c in tag.children:
-        if isinstance(c, bs4.element.NavigableString):
+        if isinstance(c, unicode):  # A bs4 NavigableString, not a tag
             if not c.isspace():   # <span> tags are the worst.
                 return unicode(c)
         # ignore 'edit' link
@@ -168,12 +352,13 @@ def getStr(tag):
                     return end
     return None
 
+@traced('getParWords')
 def getParWords(tag, y, x=0, attr=REGULAR, link = ""):
     """Return all `Word's in an HTML paragraph, with formatting."""
     words = []
     for c in tag.children:
         new_words = []
-        if isinstance(c, bs4.element.NavigableString):
+        if isinstance(c, unicode):  # A bs4 NavigableString, not a tag
             new_words, x, y = strToWords(unicode(c), y, x=x,
                     attr=attr, link=link)
         elif c.name in (u'b', u'strong'):
@@ -204,9 +389,13 @@ def getParWords(tag, y, x=0, attr=REGULAR, link = ""):
         words.extend(new_words)
     return (words, x, y)
 
+@traced('strToWords')
 def strToWords(s, y, x=0, attr=REGULAR, size=0, link="", color=BLACK,
         hlcolor=BLUE):
-    """Return string of words as `Word's, with correct locations."""
+    """Return string of words as `Word's, with correct locations.
+
+    Words are only measured here; they are rendered once they come into view.
+    """
     if s is None:
         return ([], x, y)
     s = ZERO_WIDTH.sub('', s)   # Get rid of zero-width character
@@ -216,8 +405,7 @@ def strToWords(s, y, x=0, attr=REGULAR, size=0, link="", color=BLACK,
             continue
         w = Word(word, (x, y), attr, size, link, color, hlcolor)
         if w.right >= PAGEWIDTH:
-            w.left = 0
-            w.y -= (w.top - w.bottom) + VSPACE
+            w.move(-w.left, -(w.top - w.bottom) - VSPACE)
         x = w.right + HSPACE * (size + 1)
         y = w.bottom
         words.append(w)
@@ -233,8 +421,11 @@ class Line(MySprite):
         self.scale_x = PAGEWIDTH
 
 
-class Word(MySprite):
-    """Static sprites used as platforms and that may have followable hyperlinks.
+class Word(object):
+    """Words as laid out, used as platforms that may have followable hyperlinks.
+
+    Words are measured but not rendered, and are small: a `Page' copies them
+    into its `WordStore' as they are laid out, and draws them from there.
 
     Constructors:
         'text'   : The character string of the Word.
@@ -245,14 +436,15 @@ class Word(MySprite):
         'color'  : Overrides plain text color.
         'hlcolor : Overrides hyperlink color.
     """
-    WIKI_REGULAR = None
-    WIKI_BOLD = None
-    WIKI_ITALIC = None
-    WIKI_BOLDITAL = None
+    __slots__ = ('text', 'hyperlink', 'attr', 'size', 'color', 'ff', 'left',
+                 'top', 'right', 'bottom')
     # Font dictionary WIKIFONT: for font size 'sz' in (0,1,2) with attribute
-    # 'attr', usage is: 'WIKIFONT[attr][sz]'
-    WIKIFONT = {REGULAR : WIKI_REGULAR, BOLD : WIKI_BOLD, ITALIC : WIKI_ITALIC,
-            BOLDITAL : WIKI_BOLDITAL}
+    # 'attr', usage is: 'WIKIFONT[attr][sz]'. Filled in by `fontCheck'.
+    WIKIFONT = {REGULAR : None, BOLD : None, ITALIC : None, BOLDITAL : None}
+    # Rendered words are shared between all Words and Pages.
+    ATLAS = None
+    # Sizes of rendered words, by (text, attr, size)
+    METRICS = {}
 
     def __init__(self, text, pos, attr=REGULAR, size=0, link="", color=BLACK, hlcolor=BLUE):
         fontCheck(attr)
@@ -260,6 +452,9 @@ class Word(MySprite):
         self.hyperlink = link
         if not link == "":
             color = hlcolor
+        self.attr = attr
+        self.size = size
+        self.color = color
         self.ff = FRICTION_FACTOR
         if text.lower() in STICKY_WORDS or (
                 text.lower() + 's') in STICKY_WORDS:
@@ -267,38 +462,257 @@ class Word(MySprite):
         if text.lower() in SLIPPERY_WORDS or (
                 text.lower() + 's') in SLIPPERY_WORDS:
             self.ff = SLIPPERY
-        image = Word.WIKIFONT[attr][size].render(text, True, color)
-        # Initialize sprite
-        left, bottom = pos
-        right = left + image.get_width()
-        top = bottom + image.get_height()
-        MySprite.__init__(self, texture=glutils.getTexture(image),
-                shape=[left, top, right, bottom])
+        # Measure, but don't render until `rasterize' is called
+        metric = (text, attr, size)
+        if metric not in Word.METRICS:
+            if len(Word.METRICS) > METRICS_LIMIT:
+                Word.METRICS.clear()
+            Word.METRICS[metric] = Word.WIKIFONT[attr][size].size(text)
+        width, height = Word.METRICS[metric]
+        self.left, self.bottom = pos
+        self.right = self.left + width
+        self.top = self.bottom + height
+
+    def move(self, dx, dy):
+        self.left += dx
+        self.right += dx
+        self.top += dy
+        self.bottom += dy
 
     def isLink(self):
         return not (self.hyperlink == "")
 
+    def key(self):
+        """Return what identifies this Word's image in the atlas."""
+        return (self.text, self.attr, self.size, self.color)
+
+    def record(self):
+        """Return everything needed to recreate this Word, for `layoutcache'."""
+        return (self.text, self.hyperlink, self.left, self.bottom, self.attr,
+                self.size, self.color, self.ff)
+
+
+def rasterize(key):
+    """Render a Word into the atlas, so that it can be drawn.
+
+    `key' is from `Word.key'. Return (texture, tex_shape). Each call takes a
+    share of the atlas, to be given up with `unrasterize'.
+    """
+    if Word.ATLAS is None:
+        Word.ATLAS = TextureAtlas()
+    entry = Word.ATLAS.lookup(key)
+    if entry is None:
+        text, attr, size, color = key
+        image = Word.WIKIFONT[attr][size].render(text, True, color)
+        entry = Word.ATLAS.add(key, image)
+    return entry[:2]
+
+def unrasterize(key):
+    """Give up a share of the atlas taken by `rasterize'."""
+    Word.ATLAS.release(key)
+
+
+class Label(MySprite):
+    """Sprite of a single word, drawn by itself rather than as part of a page.
+    """
+    def __init__(self, text, pos, attr=REGULAR, size=0, color=BLACK):
+        w = Word(text, pos, attr, size, color=color)
+        self.key = w.key()
+        texture, tex_shape = rasterize(self.key)
+        MySprite.__init__(self, texture=texture, shape=[w.left, w.top,
+                          w.right, w.bottom], tex_shape=tex_shape)
+
+    def release(self):
+        if self.key is not None:
+            unrasterize(self.key)
+            self.key = None
+
 
 class Page:
     """Represents a Wikipedia page as a url and a collection of Words.
     
-    The `sections' attribute divides the list of words into managable chunks,
-    so that the main loop can choose to display only words near the player's
-    location.
+    `source' may be given if the page has already been fetched and parsed by
+    `getSource', e.g. by a `Prefetcher'. If `lazy' is set, no Words are made
+    until `build' is called, so that the page can be laid out a little at a
+    time.
+
+    Words are kept in `words', a `WordStore', whose `grid' indexes them by
+    location so that the main loop can display and collide with only the
+    words near the player. Only Words near the camera are rasterized; the
+    rest are measured but not rendered. Words are referred to by their index
+    in `words'.
     """
-    def __init__(self, url):
+    def __init__(self, url, source=None, lazy=False):
         self.url = url
-        self.title, self.words, lines = getWords(getHTML(url))
-        self.lines = [Line(y) for y in lines]
-        self.lines[0].scale_y = 2
-        self.sections = [0]
-        y = -HALF_WINHEIGHT
-        i = 0
-        for w in self.words:
-            if y - w.bottom > WINHEIGHT:
-                self.sections.append(i)
-                y -= WINHEIGHT
-            i += 1
-        self.sections.append(i)
-        self.visible_words = self.words[:self.sections[1]]
+        if source is None:
+            source = getSource(url)
+        self.key, _, soup, layout = source
+        if layout is None:
+            self.title = getTitle(soup)
+            self.layout = layoutWords(soup)
+            self.cached = False
+        else:
+            self.title, records, lines = layout
+            self.layout = recordWords(records, lines)
+            self.cached = True
+        self.done = False
+        self.words = WordStore()
+        self.lines = []
+        self.rules = []     # y-coordinates of `lines'
+        self.grid = self.words.grid
+        self.bottom = 0
+        self.view_cell = None
+        self.visible_words = []     # Rasterized words near the camera
+        self.visible_serial = 0     # Changes whenever `visible_words' does
+        self.pending = []           # Words near the camera to rasterize
+        self.rasterized = {}        # Word -> (texture, tex_shape)
+        self.batch = QuadBatch()
+        if not lazy:
+            self.build()
+        self.view(0, 0)
+
+    def build(self, budget=None, until=None, words=None):
+        """Lay out more of the page, from the top down.
+
+        Stop once `budget' milliseconds have been spent, once the words reach
+        down to y-coordinate `until', once there are at least `words' Words,
+        or when the page is finished. A page finished from a soup is saved to
+        the layout cache.
+        """
+        start = time.time()
+        with TRACER.span('layout', url=self.url) as span:
+            count = len(self.words)
+            for new_words, new_lines in self.layout:
+                self.add(new_words, new_lines)
+                if (budget is not None
+                        and (time.time() - start) * 1000 > budget):
+                    break
+                if until is not None and self.bottom < until:
+                    break
+                if words is not None and len(self.words) >= words:
+                    break
+            else:
+                if not self.done and not self.cached:
+                    layoutcache.CACHE.save(self.key, self.title,
+                            [w.record() for w in self.words],
+                            self.rules)
+                self.done = True
+            span.args['words'] = len(self.words) - count
+
+    def add(self, new_words, new_lines):
+        """Add newly laid out Words and horizontal rules to the page."""
+        for w in new_words:
+            self.words.append(w)
+            self.bottom = min(self.bottom, w.bottom)
+        self.rules.extend(new_lines)
+        for y in new_lines:
+            line = Line(y)
+            if not self.lines:
+                line.scale_y = 2
+            self.lines.append(line)
+        self.view_cell = None   # Visible words may have changed
+
+    def view(self, camx, camy):
+        """Update `visible_words' for a camera centered at camx, camy.
+
+        The visible set only changes when the camera enters a new grid cell,
+        so it covers the screen plus up to a cell's margin on every side.
+        Words in it that are not rasterized yet are left to `rasterize', and
+        words far away from it are released.
+        """
+        cell = self.grid.cell
+        col, row = int(camx // cell), int(camy // cell)
+        if (col, row) == self.view_cell:
+            return
+        self.view_cell = (col, row)
+        near = self.grid.find(
+                col * cell - HALF_WINWIDTH, (row + 1) * cell + HALF_WINHEIGHT,
+                (col + 1) * cell + HALF_WINWIDTH, row * cell - HALF_WINHEIGHT)
+        self.visible_words = [w for w in near if w in self.rasterized]
+        self.visible_serial += 1
+        self.pending = [w for w in near if w not in self.rasterized]
+        # Free words well outside of the view
+        left = col * cell - HALF_WINWIDTH - RELEASE_MARGIN
+        right = (col + 1) * cell + HALF_WINWIDTH + RELEASE_MARGIN
+        top = (row + 1) * cell + HALF_WINHEIGHT + RELEASE_MARGIN
+        bottom = row * cell - HALF_WINHEIGHT - RELEASE_MARGIN
+        boxes = self.grid.boxes
+        for w in self.rasterized.keys():
+            if (boxes[4 * w + 2] < left or boxes[4 * w] > right
+                    or boxes[4 * w + 1] < bottom or boxes[4 * w + 3] > top):
+                unrasterize(self.words.key(w))
+                del self.rasterized[w]
+
+    def rasterize(self, budget=None):
+        """Rasterize Words near the camera, for at most `budget' milliseconds.
+        """
+        if not self.pending:
+            return
+        start = time.time()
+        with TRACER.span('rasterize', url=self.url) as span:
+            count = 0
+            while self.pending:
+                w = self.pending.pop()
+                self.rasterized[w] = rasterize(self.words.key(w))
+                self.visible_words.append(w)
+                self.visible_serial += 1
+                count += 1
+                if (budget is not None
+                        and (time.time() - start) * 1000 > budget):
+                    break
+            span.args['words'] = count
+
+    def trim(self):
+        """Free the textures of rasterized words that are out of view."""
+        visible = set(self.visible_words)
+        for w in self.rasterized.keys():
+            if w not in visible:
+                unrasterize(self.words.key(w))
+                del self.rasterized[w]
+
+    def prepare(self):
+        """Bring `batch' up to date with the visible words."""
+        rasterized, box = self.rasterized, self.words.box
+        self.batch.update(((rasterized[w][0], box(w), rasterized[w][1])
+                           for w in self.visible_words), self.visible_serial)
+
+    def render(self):
+        """Draw the visible words and horizontal rules."""
+        self.prepare()
+        self.batch.render()
+        rabbyt.render_unsorted(self.lines)
+
+    def footprint(self):
+        """Return roughly how many bytes the page's layout takes up.
+
+        Textures are not counted: a page kept for later is `shelve'd first.
+        """
+        return self.words.footprint()
+
+    def near(self, sprite):
+        """Return the words that may be touching `sprite'."""
+        return self.words.query(sprite.left, sprite.top, sprite.right,
+                                sprite.bottom)
+
+    def shelve(self):
+        """Free the textures of every Word, but keep the layout.
+
+        Call when leaving the page to come back later. `view' and `rasterize'
+        bring back the words near the camera.
+        """
+        self.pending = []
+        for w in self.rasterized:
+            unrasterize(self.words.key(w))
+        self.rasterized.clear()
+        self.visible_words = []
+        self.visible_serial += 1
+        self.view_cell = None
+        self.batch.release()
+
+    def release(self):
+        """Free the textures of every Word and Line. Call when leaving page."""
+        self.layout = iter(())  # Build no more
+        self.shelve()
+        for l in self.lines:
+            l.release()
 
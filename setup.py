@@ -9,7 +9,7 @@ includes = ["OpenGL.platform.win32", "platform", "OpenGL.arrays",
             "OpenGL.arrays.lists", "OpenGL.arrays.numbers",
             "OpenGL.arrays.strings"]
 
-includefiles = ["README.txt", "LICENSE.txt", "images", "fonts"]
+includefiles = ["README.txt", "LICENSE.txt", "images", "fonts", "pages"]
 
 build_exe_options = {"packages": ["os"],
         "includes": includes,
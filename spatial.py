@@ -0,0 +1,67 @@
+"""Spatial index for finding word boxes by location.
+"""
+# Copyright 2013 Aaron Graham-Horowitz
+#
+# This file is part of Escape from Wikipedia.
+#
+# Escape from Wikipedia is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or any later version.
+#
+# Escape from Wikipedia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from array import array
+from constants import *
+
+class WordGrid:
+    """Uniform grid of square cells, each listing the boxes that touch it.
+
+    Boxes are kept flat in `boxes', as left, top, right, bottom each, and
+    are found again by index with `find'. Finding looks only at the cells
+    under the requested rectangle, so its cost depends on the size of the
+    rectangle, not on the number of boxes stored.
+    """
+    def __init__(self, cell=GRID_CELL):
+        self.cell = cell
+        self.boxes = array('f')
+        self.cells = {}     # (column, row) -> indices into `boxes'
+
+    def __len__(self):
+        return len(self.boxes) // 4
+
+    def span(self, left, top, right, bottom):
+        """Return the ranges of columns and rows covering a rectangle."""
+        c = self.cell
+        return (xrange(int(left // c), int(right // c) + 1),
+                xrange(int(bottom // c), int(top // c) + 1))
+
+    def add(self, left, top, right, bottom):
+        """Store a box. Return its index."""
+        i = len(self)
+        self.boxes.extend((left, top, right, bottom))
+        cols, rows = self.span(left, top, right, bottom)
+        for col in cols:
+            for row in rows:
+                self.cells.setdefault((col, row), []).append(i)
+        return i
+
+    def find(self, left, top, right, bottom):
+        """Return the indices of boxes that intersect the given rectangle.
+
+        Indices come back in the order the boxes were added.
+        """
+        cols, rows = self.span(left, top, right, bottom)
+        found = set()
+        for col in cols:
+            for row in rows:
+                found.update(self.cells.get((col, row), ()))
+        b = self.boxes
+        return [i for i in sorted(found) if b[4 * i] <= right
+                and b[4 * i + 2] >= left and b[4 * i + 3] <= top
+                and b[4 * i + 1] >= bottom]
@@ -16,7 +16,7 @@
 # You should have received a copy of the GNU General Public License along with
 # this program.  If not, see <http://www.gnu.org/licenses/>.
 
-import math, pygame, rabbyt, random, os
+import math, rabbyt, random, os
 import glutils
 from constants import *
 
@@ -35,15 +35,26 @@ class Counter:
 
 
 class MySprite(rabbyt.sprites.Sprite):
-    """rabbyt sprite that always uses OpenGL textures."""
+    """rabbyt sprite that always uses OpenGL textures.
+
+    Textures loaded from an image file are owned by the sprite, and handed
+    back by `release'.
+    """
     def __init__(self, texture=None, shape=None, tex_shape=(0,1,1,0)):
+        self.owned_texture = None
         if isinstance(texture, basestring):
-            image = pygame.image.load(texture).convert_alpha()
-            texture = glutils.getTexture(image)
-            shape = [0, image.get_height(), image.get_width(), 0]
+            texture, (width, height) = glutils.loadTexture(texture)
+            shape = [0, height, width, 0]
+            self.owned_texture = texture
         rabbyt.sprites.Sprite.__init__(self, texture=texture, shape=shape,
                           tex_shape=tex_shape)
 
+    def release(self):
+        """Give up this sprite's texture. The sprite must not be drawn again."""
+        if self.owned_texture is not None:
+            glutils.releaseTexture(self.owned_texture)
+            self.owned_texture = None
+
 
 class Jumper(MySprite):
     """Generic sprite affected by gravity and obstacles. Can move and jump."""
@@ -97,6 +108,33 @@ class Jumper(MySprite):
                 self.plat = None
                 self.jumps += 1
 
+    def collide(self, plats):
+        """Push out of any of `plats' that overlap, landing if falling.
+
+        Return the platform landed on, if any.
+        """
+        landed = None
+        # Forced out of platforms by most direct route, more or less;
+        for plat in rabbyt.collisions.aabb_collide_single(self, plats):
+            if (self.right / 3 + 2 * self.left / 3 < plat.left
+            and self.velocity[0] > 0):
+                self.right = plat.left - 1
+            elif (self.left / 3 + 2 * self.right / 3 > plat.right
+            and self.velocity[0] < 0):
+                self.left = plat.right + 1
+            # More sensitive about the top, to compensate for high fall veloc
+            elif self.top > plat.top and self.velocity[1] < 0:
+                self.bottom = plat.top + 1
+                self.plat = plat
+                self.velocity[1] = 0   # Stop falling
+                self.jumps = 0         # Reset jumps
+                landed = plat
+            elif (2 * self.top / 3 + self.bottom / 3 < plat.bottom
+            and self.velocity[1] > 0):
+                self.top = plat.bottom - 1
+                self.velocity[1] = 0   # Jump stops
+        return landed
+
     def jump(self):
         if self.jumps < self.max_jumps:
             js = self.jumpspeed
@@ -110,15 +148,20 @@ class Jumper(MySprite):
 
 
 class Player(Jumper):
-    """Player-controlled sprite, with afterimage."""
-    def __init__(self, pos):
+    """Player-controlled sprite, with afterimage.
+
+    Random choices are made with `rng', so that a seeded `random.Random'
+    makes a game repeatable.
+    """
+    def __init__(self, pos, rng=random):
         Jumper.__init__(self, texture=os.path.join('images', 'player.png'))
+        self.rng = rng
         self.scale = PLAYER_SCALE
         self.xy = pos
         self.max_jumps = NUMBER_JUMPS
         # Create shadow
         self.shadow = MySprite(os.path.join('images',
-            'shadow' + str(random.randrange(4,6)) + ".png"))
+            'shadow' + str(rng.randrange(4,6)) + ".png"))
         # Create enlarged image
         self.image = MySprite(texture=os.path.join('images', 'player.png'))
         self.image.x = self.attrgetter('x') - 4
@@ -136,17 +179,35 @@ class Player(Jumper):
                 c.dec()
         Jumper.update(self)
 
+    def collide(self, plats):
+        landed = Jumper.collide(self, plats)
+        if landed is not None and landed.isLink():
+            self.hl_landed(TIMEOUT)
+        return landed
+
     def render(self):
         self.shadow.render()
         self.image.render()
 
+    def release(self):
+        Jumper.release(self)
+        self.shadow.release()
+        self.image.release()
+
     def reset(self, page=None):
         if page is None:
             self.xy = PLAYER_START
         else:
-            w = random.sample(page.words, 1)[0]
-            self.bottom = w.top + 1
-            self.x = (w.left + w.right) / 2
+            # Look for a word with room to stand on it in the first few
+            # screens, so that long pages don't take longer to start on
+            page.build(until=-SPAWN_SCREENS * WINHEIGHT)
+            for _ in xrange(RESET_TRIES):
+                w = self.rng.choice(page.words)
+                self.bottom = w.top + 1
+                self.x = (w.left + w.right) / 2
+                if page.words.query(self.left, self.top, self.right,
+                                    self.bottom - 2) == [w]:
+                    break
         self.velocity = [0.0, 0.0]
         self.plat = None
 
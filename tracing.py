@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+"""Tracing of page loads, as nested timed spans.
+
+Usage: tracing.py [summary.jsonl]
+
+Code to be traced runs inside `TRACER.span(name)', or is wrapped with
+`traced(name)'. Spans started inside another on the same thread nest in it,
+and take on its `url'. While `TRACER' is disabled, spans cost next to
+nothing. Once enabled, `save' writes everything recorded as Chrome trace
+events (load the file in chrome://tracing), and `saveSummary' adds a line
+per page to a summary file that grows across sessions. Run this module to
+print load time percentiles from a summary file.
+"""
+# Copyright 2013 Aaron Graham-Horowitz
+#
+# This file is part of Escape from Wikipedia.
+#
+# Escape from Wikipedia is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or any later version.
+#
+# Escape from Wikipedia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import sys, os, json, threading, timeit, time, functools
+from constants import *
+
+class Span:
+    """One timed piece of work. Add counts etc. to `args' while it runs."""
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        stack = self.tracer.stack()
+        if stack and 'url' not in self.args and 'url' in stack[-1].args:
+            self.args['url'] = stack[-1].args['url']
+        # Inside another span of the same name, e.g. a recursive call
+        self.nested = any(s.name == self.name for s in stack)
+        stack.append(self)
+        self.start = timeit.default_timer()
+        return self
+
+    def __exit__(self, *exc_info):
+        end = timeit.default_timer()
+        self.tracer.stack().pop()
+        self.tracer.add(self, end)
+        return False
+
+
+class NullSpan:
+    """Stands in for a `Span' while tracing is disabled."""
+    def __init__(self):
+        self.args = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+NULL_SPAN = NullSpan()
+
+
+class Tracer:
+    """Collects `Span's from every thread, while `enabled'.
+
+    At most `limit' spans are kept; later ones are counted in `dropped'.
+    """
+    def __init__(self, limit=TRACE_EVENTS):
+        self.enabled = False
+        self.limit = limit
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.events = []
+        self.dropped = 0
+        self.origin = timeit.default_timer()
+
+    def enable(self):
+        self.enabled = True
+
+    def span(self, name, **args):
+        """Return a context manager timing `name', with extra `args'."""
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, name, args)
+
+    def stack(self):
+        """Return the spans open on the current thread, innermost last."""
+        try:
+            return self.local.stack
+        except AttributeError:
+            self.local.stack = []
+            return self.local.stack
+
+    def add(self, span, end):
+        event = {'name': span.name, 'ph': 'X', 'pid': os.getpid(),
+                 'tid': threading.current_thread().ident,
+                 'ts': (span.start - self.origin) * 1e6,
+                 'dur': (end - span.start) * 1e6, 'args': span.args,
+                 'nested': span.nested}
+        with self.lock:
+            if len(self.events) < self.limit:
+                self.events.append(event)
+            else:
+                self.dropped += 1
+
+    def take(self, start):
+        """Return the spans recorded so far, timed from `start', and forget
+        them. For another process's `Tracer' to `merge'.
+        """
+        shift = (start - self.origin) * 1e6
+        with self.lock:
+            events, self.events = self.events, []
+        for e in events:
+            e['ts'] -= shift
+        return events
+
+    def merge(self, events, start, **args):
+        """Add spans from `take', timed from `start', with extra `args'."""
+        shift = (start - self.origin) * 1e6
+        with self.lock:
+            for e in events:
+                e['ts'] += shift
+                for name, value in args.iteritems():
+                    e['args'].setdefault(name, value)
+                if len(self.events) < self.limit:
+                    self.events.append(e)
+                else:
+                    self.dropped += 1
+
+    def save(self, path):
+        """Write every span as Chrome trace event JSON."""
+        with self.lock:
+            events = list(self.events)
+            dropped = self.dropped
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': events,
+                       'otherData': {'dropped': dropped}}, f)
+
+    def loads(self):
+        """Return one record per page traced.
+
+        Each has the time spent in every kind of span, in milliseconds, and
+        the byte and word counts added up, per kind. Spans nested in one of
+        the same kind are not counted again.
+        """
+        pages = {}
+        with self.lock:
+            events = list(self.events)
+        for e in events:
+            url = e['args'].get('url')
+            if url is None or e['nested']:
+                continue
+            page = pages.setdefault(url, {'url': url, 'ms': {}, 'bytes': {},
+                                          'words': {}})
+            name = e['name']
+            page['ms'][name] = page['ms'].get(name, 0.0) + e['dur'] / 1000.0
+            for count in ('bytes', 'words'):
+                if count in e['args']:
+                    page[count][name] = page[count].get(name, 0) + \
+                            e['args'][count]
+        return pages.values()
+
+    def saveSummary(self, path=LOAD_SUMMARY):
+        """Add a line per page traced this session to the summary file."""
+        session = time.time()
+        with open(path, 'a') as f:
+            for page in self.loads():
+                page['session'] = session
+                f.write(json.dumps(page) + '\n')
+
+
+TRACER = Tracer()
+
+def traced(name):
+    """Decorator to time every call of a function as span `name'."""
+    def decorate(f):
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            if not TRACER.enabled:
+                return f(*args, **kwargs)
+            with Span(TRACER, name, {}):
+                return f(*args, **kwargs)
+        return wrapper
+    return decorate
+
+def percentile(values, p):
+    """Return the `p'th percentile of sorted `values'."""
+    return values[int(p / 100.0 * (len(values) - 1))]
+
+def main():
+    path = sys.argv[1] if len(sys.argv) > 1 else LOAD_SUMMARY
+    stages = {}
+    sessions = set()
+    with open(path) as f:
+        for line in f:
+            page = json.loads(line)
+            sessions.add(page['session'])
+            for name, ms in page['ms'].iteritems():
+                stages.setdefault(name, []).append(ms)
+    print('%d sessions' % len(sessions))
+    print('%-12s %7s %9s %9s %9s %9s' % ('span (ms)', 'pages', '50%', '90%',
+                                         '99%', 'max'))
+    for name in sorted(stages):
+        times = sorted(stages[name])
+        print('%-12s %7d %9.1f %9.1f %9.1f %9.1f' % (name, len(times),
+                percentile(times, 50), percentile(times, 90),
+                percentile(times, 99), times[-1]))
+
+
+if __name__ == '__main__':
+    main()
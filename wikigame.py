@@ -22,12 +22,21 @@ See "README.txt" for instructions.
 # TODO: Add some kind of score keeping.
 # TODO: Create some sort of reward for reaching the top of a page.
 
-import sys, os, pygame, rabbyt
+import timeit
+STARTED = timeit.default_timer()    # Before the slow imports, for `Startup'
+import sys, os, random, argparse, multiprocessing, numpy, pygame, rabbyt
 from pygame.locals import *
 from constants import *
-import glutils
+import glutils, worldpack
 from sprites import Player
-from scrapewiki import Page, Word
+from creatures import Swarm
+from scrapewiki import Page, Label, preloadFonts
+from prefetch import Prefetcher
+from history import History
+from parsepool import ParsePool
+from replay import Session, Recorder, Replay
+from profiler import Profiler
+from tracing import TRACER
 
 # Make sure we can use our .png and other images
 assert(pygame.image.get_extended() > 0)
@@ -38,19 +47,115 @@ UP_KEYS = (K_UP, K_w)
 DOWN_KEYS = (K_DOWN, K_s)
 QUIT_KEYS = (K_ESCAPE, )
 RESTART_KEYS = (K_r, )
+BACK_KEYS = (K_BACKSPACE, K_b)
+FORWARD_KEYS = (K_f, )
+PROFILE_KEYS = (K_F3, )
 
-FPS = 90
+FPS = 90               # Most frames drawn per second
+IDLE_FPS = 20          # Frames per second while nothing on screen moves
+STEP_RATE = 90         # Physics steps per second, whatever the frame rate
+STEP = 1000.0 / STEP_RATE   # Milliseconds per physics step
+MAX_STEPS = 6          # Most steps per frame before the game slows instead
 TIME_FACTOR = 1000.0   # Helps rabbyt read pygame ticks
 
 
+class Startup:
+    """Times from launch to the first frame drawn and first page playable."""
+    def __init__(self):
+        self.times = {}
+
+    def mark(self, name):
+        """Note the time `name' first happened, in milliseconds."""
+        if name not in self.times:
+            self.times[name] = (timeit.default_timer() - STARTED) * 1000
+
+    def summary(self):
+        return ['startup: %s %.0f ms' % (name, self.times[name])
+                for name in ('first frame', 'first page')
+                if name in self.times]
+
+STARTUP = Startup()
+
+
 def terminate():
     """Quit and clean up."""
     pygame.quit()
     sys.exit()
 
 def main():
-    """Initialize environment, then start game instance."""
+    """Initialize environment, then start game instance.
+
+    With `--record', the first game is saved as a trace for `--replay'.
+    Frames timed with the profiler are written to PROFILE_CSV, and
+    with `--trace-loads', page loads are traced and added to LOAD_SUMMARY.
+    With `--world', pages are served from a pack made by `buildworld'.
+    The first game starts on START_PAGE, bundled with the game, so there is
+    something to play while the first article loads; `--no-start-page'
+    goes straight to a random article. How long the first frame and first
+    page took to show is printed on exit.
+    """
+    argparser = argparse.ArgumentParser(description='Escape from Wikipedia.')
+    argparser.add_argument('--record', metavar='TRACE',
+            help='save the first game played to TRACE')
+    argparser.add_argument('--replay', metavar='TRACE',
+            help='play back TRACE as fast as possible and report timings')
+    argparser.add_argument('--headless', action='store_true',
+            help='replay without opening a window')
+    argparser.add_argument('--timings', metavar='CSV',
+            help="write each replayed frame's timings to CSV")
+    argparser.add_argument('--trace-loads', metavar='JSON',
+            help='save spans of every page load to JSON, for chrome://tracing')
+    argparser.add_argument('--world', metavar='PACK',
+            help='play the pages in PACK, made by buildworld.py')
+    argparser.add_argument('--no-start-page', action='store_true',
+            help='start on a random article instead of the bundled page')
+    args = argparser.parse_args()
+
+    pool = None
+    if args.replay is None:
+        pool = ParsePool()  # Before pygame starts, so workers don't inherit it
     pygame.init()
+    preloadFonts()
+    if args.world is not None:
+        worldpack.openWorld(args.world)
+    if args.trace_loads is not None:
+        TRACER.enable()
+    try:
+        if args.replay is not None:
+            replayGame(args)
+        else:
+            playGame(args, pool)
+    finally:
+        if pool is not None:
+            pool.close()
+        if args.trace_loads is not None:
+            TRACER.save(args.trace_loads)
+            TRACER.saveSummary()
+
+def playGame(args, pool):
+    """Play games until the player quits, laying out pages in `pool'."""
+    openWindow()
+    prefetcher = Prefetcher(pool=pool)
+    profiler = Profiler(target_ms=1000.0 / FPS, path=PROFILE_CSV)
+    start = RANDOM_URL if args.no_start_page else START_PAGE
+    try:
+        if args.record is not None:
+            recorder = Recorder(profiler=profiler)
+            try:
+                runGame(prefetcher, recorder, start)
+            finally:
+                recorder.save(args.record)
+            start = RANDOM_URL
+        session = Session(profiler)
+        while True:
+            runGame(prefetcher, session, start)     # Allows restarts
+            start = RANDOM_URL
+    finally:
+        profiler.close()
+        for line in STARTUP.summary():
+            print(line)
+
+def openWindow():
     pygame.display.set_mode( (WINWIDTH, WINHEIGHT),
                              pygame.OPENGL | pygame.DOUBLEBUF )
     # (0,0) is center point of screen
@@ -60,44 +165,128 @@ def main():
         'gameicon.png')).convert_alpha())
     pygame.display.set_caption('Escape from Wikipedia')
 
-    while True:
-        runGame()       # Allows restarts
+def replayGame(args):
+    """Play back a recorded game, then print how long each frame took."""
+    if args.headless:
+        glutils.setBackend('null')
+    else:
+        openWindow()
+    session = Replay(args.replay, render=not args.headless,
+                     timings=args.timings)
+    try:
+        # No workers, so nothing is ever fetched
+        runGame(Prefetcher(workers=0, random_pages=0), session,
+                session.start)
+    except SystemExit:
+        pass
+    for line in session.profiler.summary():
+        print(line)
+    sys.stdout.flush()
+    session.profiler.close()
 
-def runGame():
-    """Initialize new game."""
+def loadPage(url, prefetcher, session, fpsclock, camx, camy):
+    """Show loading screen until `url' is fetched and its top is laid out.
+
+    The rest of the returned page is left to be built a little every frame.
+    """
     pygame.display.set_caption('Escape from Wikipedia - Loading')
+    with TRACER.span('load', url=url):
+        loading = Label("LOADING", (camx - 205, camy - 55),
+                attr=BOLD, size=2, color=PURPLE)
+        source = session.source(url, prefetcher)
+        while source is None:
+            # Leave other events queued for the main loop
+            for event in pygame.event.get([QUIT, KEYDOWN]):
+                if event.type == QUIT or event.key in QUIT_KEYS:
+                    terminate()
+            rabbyt.clear(WHITE)
+            loading.render()     # Loading screen
+            pygame.display.flip()
+            STARTUP.mark('first frame')
+            fpsclock.tick(FPS)
+            source = session.source(url, prefetcher)
+        page = Page(url, source, lazy=True)
+        page.build(until=-WINHEIGHT)   # First screen
+        loading.release()
+    pygame.display.set_caption('Escape from...   ' + page.title)
+    session.mark('load')
+    return page
+
+def followPlayer(player, camx, camy):
+    """Move the camera if the player is beyond the "camera slack".
+
+    Return the new camera position.
+    """
+    if camx - player.x > CAMERASLACK:
+        glutils.scroll(player.x + CAMERASLACK - camx, 0)
+        camx = player.x + CAMERASLACK
+    elif player.x - camx > CAMERASLACK:
+        glutils.scroll(player.x - CAMERASLACK - camx, 0)
+        camx = player.x - CAMERASLACK
+    if camy - player.y > CAMERASLACK:
+        glutils.scroll(0, player.y + CAMERASLACK - camy)
+        camy = player.y + CAMERASLACK
+    elif player.y - camy > CAMERASLACK:
+        glutils.scroll(0, player.y - CAMERASLACK - camy)
+        camy = player.y - CAMERASLACK
+    return camx, camy
+
+def runGame(prefetcher, session, start=RANDOM_URL):
+    """Initialize new game at `start', fetching linked pages early with
+    `prefetcher'.
+
+    Input, time and pages come through `session', e.g. a `Replay'.
+    """
     fpsclock = pygame.time.Clock()
     camx = 0
     camy = 0
-    section = 0
-    player = Player(PLAYER_START)
-    loading = Word("LOADING", (camx - 205, camy - 55),
-            attr=BOLD, size=2, color=PURPLE)
-    rabbyt.clear(WHITE)
-    loading.render()     # Loading screen
-    pygame.display.flip()
+    player = Player(PLAYER_START, random.Random(session.seed))
     # Short, simple page
-    #page = Page("http://en.wikipedia.org/wiki/Solariellidae")
+    #page = loadPage("http://en.wikipedia.org/wiki/Solariellidae",
+    #        prefetcher, session, fpsclock, camx, camy)
     # Longest page in Wikipedia
-    #page = Page("http://en.wikipedia.org/wiki/Character_mask")
-    # Random page
-    page = Page("http://en.wikipedia.org/wiki/Special:Random")
-    pygame.display.set_caption('Escape from...   ' + page.title)
+    #page = loadPage("http://en.wikipedia.org/wiki/Character_mask",
+    #        prefetcher, session, fpsclock, camx, camy)
+    # Random page, or the page bundled with the game
+    page = loadPage(start, prefetcher, session, fpsclock, camx, camy)
+    STARTUP.mark('first page')
     # xkcd
-    #page = Page("http://en.wikipedia.org/wiki/Xkcd")
+    #page = loadPage("http://en.wikipedia.org/wiki/Xkcd",
+    #        prefetcher, session, fpsclock, camx, camy)
     #print len(page.words)
+    npc_rng = numpy.random.RandomState(session.seed)
+    swarm = Swarm(NPC_COUNT)
+    swarm.spawn(page, npc_rng)
+    history = History()
+
+    # Physics runs in fixed steps of STEP ms, however long frames take.
+    # `lag' is the time not yet simulated; `prev' and `prev_cam' are the
+    # player and camera positions before the latest step, for drawing frames
+    # that fall between steps.
+    lag = 0.0
+    last = session.ticks()
+    prev = player.xy
+    prev_cam = (camx, camy)
 
     # Main loop
     while True:
 
-        for event in pygame.event.get():
+        for event in session.events():
             if event.type == QUIT:
                 terminate()
             elif event.type == KEYDOWN:
+                arrived = False     # Set on moving to another page
                 if event.key in QUIT_KEYS:
                     terminate()
+                elif event.key in PROFILE_KEYS:
+                    session.toggleProfiler()
                 elif event.key in RESTART_KEYS:
                     glutils.scroll(-camx, -camy) # Reset glMatrix
+                    page.release()
+                    history.release()
+                    player.release()
+                    swarm.release()
+                    prefetcher.cancelAll()
                     return
                 elif event.key in LEFT_KEYS:
                     player.goingleft = True
@@ -112,19 +301,50 @@ def runGame():
                 elif event.key in DOWN_KEYS and player.plat is not None:
                     # Enter hyperlink
                     if not player.plat.hyperlink == "":
-                        pygame.display.set_caption(
-                                'Escape from Wikipedia - Loading')
-                        loading = Word("LOADING", (camx - 205, camy - 55),
-                                attr=BOLD, size=2, color=PURPLE)
-                        rabbyt.clear(WHITE)
-                        loading.render()   # Display load screen
-                        pygame.display.flip()
-                        page = Page(player.plat.hyperlink)
-                        pygame.display.set_caption(page.title)
-                        pygame.display.set_caption('Escape from...   '
-                                + page.title)
+                        # The old page is kept built in `history'
+                        url = player.plat.hyperlink
+                        new_page = history.find(url)
+                        if new_page is None:
+                            new_page = loadPage(url, prefetcher, session,
+                                                fpsclock, camx, camy)
+                        history.follow(page, player.xy, (camx, camy))
+                        page = new_page
                         #print len(page.words)
                         player.reset(page)
+                        arrived = True
+                elif event.key in BACK_KEYS + FORWARD_KEYS:
+                    if event.key in BACK_KEYS:
+                        visit = history.back(page, player.xy, (camx, camy))
+                    else:
+                        visit = history.forward(page, player.xy,
+                                                (camx, camy))
+                    if visit is not None:
+                        page = visit.page
+                        if page is None:    # Released to save memory
+                            page = loadPage(visit.url, prefetcher, session,
+                                            fpsclock, camx, camy)
+                            page.build(until=visit.camera[1] - WINHEIGHT)
+                        # Back where the player left the page
+                        player.xy = visit.pos
+                        player.velocity = [0.0, 0.0]
+                        player.plat = None
+                        glutils.scroll(visit.camera[0] - camx,
+                                       visit.camera[1] - camy)
+                        camx, camy = visit.camera
+                        # Rasterize the words in view now, not over the
+                        # next few frames
+                        page.view(camx, camy)
+                        page.rasterize()
+                        arrived = True
+                if arrived:
+                    prefetcher.cancelAll()   # Links on old page are stale
+                    swarm.spawn(page, npc_rng)
+                    pygame.display.set_caption('Escape from...   ' +
+                                               page.title)
+                    prev = player.xy
+                    prev_cam = (camx, camy)
+                    last = session.ticks()  # Don't make up
+                    lag = 0.0               # for loading time
             elif event.type == KEYUP:
                 if event.key in LEFT_KEYS:
                     player.goingleft = False
@@ -133,72 +353,84 @@ def runGame():
                 elif event.key in UP_KEYS and player.velocity[1] > 0:
                     player.velocity[1] *= 0.5   # Control jump height
 
-        # Update position
-        player.update()
-
-        # Check for player-platform collisions
-        collisions = rabbyt.collisions.aabb_collide_single(player,
-                page.visible_words)
-        # Player forced out of platforms by most direct route, more or less;
-        for plat in collisions:
-            if (player.right / 3 + 2 * player.left / 3 < plat.left
-            and player.velocity[0] > 0):
-                player.right = plat.left - 1
-            elif (player.left / 3 + 2 * player.right / 3 > plat.right
-            and player.velocity[0] < 0):
-                player.left = plat.right + 1
-            # More sensitive about the top, to compensate for high fall veloc
-            elif player.top > plat.top and player.velocity[1] < 0:
-                player.bottom = plat.top + 1
-                player.plat = plat
-                player.velocity[1] = 0   # Stop falling
-                player.jumps = 0         # Reset jumps
-                if plat.hyperlink != "":
-                    player.hl_landed(TIMEOUT)
-            elif (2 * player.top / 3 + player.bottom / 3 < plat.bottom
-            and player.velocity[1] > 0):
-                player.top = plat.bottom - 1
-                player.velocity[1] = 0   # Jump stops
-
-        prev_section = section
-        prev_y = camy
-        # adjust camera if beyond the "camera slack"
-        if camx - player.x > CAMERASLACK:
-            glutils.scroll(player.x + CAMERASLACK - camx, 0)
-            camx = player.x + CAMERASLACK
-        elif player.x - camx > CAMERASLACK:
-            glutils.scroll(player.x - CAMERASLACK - camx, 0)
-            camx = player.x - CAMERASLACK
-        if camy - player.y > CAMERASLACK:
-            glutils.scroll(0, player.y + CAMERASLACK - camy)
-            camy = player.y + CAMERASLACK
-        elif player.y - camy > CAMERASLACK:
-            glutils.scroll(0, player.y - CAMERASLACK - camy)
-            camy = player.y - CAMERASLACK
-
-        # Keep track of viewing section
-        section += int(prev_y / WINHEIGHT) - int(camy / WINHEIGHT)
-        if not section == prev_section:
-            if section > len(page.sections) + 1:
+        session.mark('input')
+
+        now = session.ticks()
+        lag = min(lag + now - last, MAX_STEPS * STEP)
+        last = now
+        while lag >= STEP:
+            lag -= STEP
+            prev = player.xy
+            prev_cam = (camx, camy)
+
+            # Update position
+            player.update()
+            swarm.wander(npc_rng)
+            swarm.update()
+            session.mark('physics')
+
+            # Check for player-platform collisions
+            landed = player.collide(page.near(player))
+            if landed is not None and landed.isLink():
+                prefetcher.request(landed.hyperlink)
+            swarm.collide(page)
+            session.mark('collision')
+
+            camx, camy = followPlayer(player, camx, camy)
+            session.mark('camera')
+
+            # Restart after falling off the bottom of the page
+            if page.done and camy < page.bottom - 2 * WINHEIGHT:
                 glutils.scroll(-camx, -camy) # Reset glMatrix
+                page.release()
+                history.release()
+                player.release()
+                swarm.release()
+                prefetcher.cancelAll()
                 return
-            page.visible_words = page.words[
-                    page.sections[min(len(page.sections) - 1, max(0, section - 1))]:
-                    page.sections[max(0, min(len(page.sections) - 1, section + 1))]]
 
-        # Slow to FPS
-        fpsclock.tick(FPS)
+        # Lay out more of the page while the player is busy
+        if not page.done:
+            session.build(page)
+        session.mark('layout')
+        page.view(camx, camy)
+        page.rasterize(RASTER_BUDGET)
+        if glutils.textureStats()[1] > TEXTURE_BUDGET:
+            page.trim()     # Keep only the words in view
+        session.mark('view')
+
         # Need to tell Rabbyt what time it is every frame
-        rabbyt.set_time(pygame.time.get_ticks() / TIME_FACTOR)
+        rabbyt.set_time(now / TIME_FACTOR)
 
-        # Draw screen
-        rabbyt.clear(WHITE)
-        rabbyt.render_unsorted(page.visible_words)
-        rabbyt.render_unsorted(page.lines)
-        player.render()
-        pygame.display.flip()
+        # Draw screen part way from the previous step to the latest one
+        alpha = lag / STEP
+        x, y = player.xy
+        player.xy = (prev[0] + alpha * (x - prev[0]),
+                     prev[1] + alpha * (y - prev[1]))
+        dx = (alpha - 1) * (camx - prev_cam[0])
+        dy = (alpha - 1) * (camy - prev_cam[1])
+        glutils.scroll(dx, dy)
+        if session.render:
+            rabbyt.clear(WHITE)
+            page.render()
+            swarm.render(alpha)
+            player.render()
+            session.profiler.render(camx + dx, camy + dy)
+            pygame.display.flip()
+            STARTUP.mark('first frame')
+        glutils.scroll(-dx, -dy)
+        player.xy = (x, y)
+        session.mark('render')
 
+        # Slow down while there is nothing to animate. Otherwise draw as
+        # often as FPS allows; a slow machine just draws less often.
+        idle = (page.done and not page.pending and player.plat is not None
+                and player.xy == prev
+                and not (player.goingleft or player.goingright)
+                and swarm.resting())
+        session.tick(fpsclock, IDLE_FPS if idle else FPS)
 
 if __name__ == '__main__':
+    multiprocessing.freeze_support()    # For ParsePool workers in a frozen exe
     main()
 
@@ -0,0 +1,176 @@
+"""Compact storage for the laid out words of a page.
+"""
+# Copyright 2013 Aaron Graham-Horowitz
+#
+# This file is part of Escape from Wikipedia.
+#
+# Escape from Wikipedia is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or any later version.
+#
+# Escape from Wikipedia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from array import array
+from constants import *
+from spatial import WordGrid
+
+class WordStore:
+    """The Words of a page, kept as parallel arrays rather than objects.
+
+    Word i's box is in `grid', which indexes the boxes by location. Its
+    text and hyperlink are indices into `strings', and its color an index
+    into `colors', so repeated strings and colors are only kept once.
+    Indexing a store gives a `StoredWord' to read the rest.
+    """
+    def __init__(self):
+        self.grid = WordGrid()
+        self.strings = [""]
+        self.string_index = {"": 0}
+        self.colors = []
+        self.color_index = {}
+        self.text = array('I')
+        self.link = array('I')
+        self.attr = array('B')
+        self.size = array('B')
+        self.color = array('B')
+        self.ff = array('d')
+
+    def __len__(self):
+        return len(self.ff)
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('word index out of range')
+        return StoredWord(self, i)
+
+    def intern(self, s):
+        """Return the index of string `s' in `strings', adding it if new."""
+        i = self.string_index.get(s)
+        if i is None:
+            i = self.string_index[s] = len(self.strings)
+            self.strings.append(s)
+        return i
+
+    def append(self, word):
+        """Copy a laid out `Word' into the store. Return its index."""
+        color = self.color_index.get(word.color)
+        if color is None:
+            color = self.color_index[word.color] = len(self.colors)
+            self.colors.append(word.color)
+        self.text.append(self.intern(word.text))
+        self.link.append(self.intern(word.hyperlink))
+        self.attr.append(word.attr)
+        self.size.append(word.size)
+        self.color.append(color)
+        self.ff.append(word.ff)
+        return self.grid.add(word.left, word.top, word.right, word.bottom)
+
+    def footprint(self):
+        """Return roughly how many bytes the words take up."""
+        arrays = (self.grid.boxes, self.text, self.link, self.attr, self.size,
+                  self.color, self.ff)
+        return (sum(a.itemsize * len(a) for a in arrays) +
+                sum(len(s) for s in self.strings) +
+                GRID_ENTRY_BYTES * len(self))
+
+    def box(self, i):
+        """Return (left, top, right, bottom) of word `i'."""
+        return tuple(self.grid.boxes[4 * i:4 * i + 4])
+
+    def key(self, i):
+        """Return the atlas key of word `i', as for `Word.key'."""
+        return (self.strings[self.text[i]], self.attr[i], self.size[i],
+                self.colors[self.color[i]])
+
+    def find(self, left, top, right, bottom):
+        """Return the indices of words that intersect the given rectangle."""
+        return self.grid.find(left, top, right, bottom)
+
+    def query(self, left, top, right, bottom):
+        """Return the words that intersect the given rectangle."""
+        return [StoredWord(self, i) for i in
+                self.grid.find(left, top, right, bottom)]
+
+
+class StoredWord(object):
+    """One word of a `WordStore', read in place.
+
+    Has the attributes of the `Word' it was made from, so that it can be
+    collided with and stood on. Made as needed and thrown away; two for the
+    same word compare equal.
+    """
+    __slots__ = ('store', 'index')
+
+    def __init__(self, store, index):
+        self.store = store
+        self.index = index
+
+    def __eq__(self, other):
+        return (isinstance(other, StoredWord) and self.store is other.store
+                and self.index == other.index)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((id(self.store), self.index))
+
+    @property
+    def left(self):
+        return self.store.grid.boxes[4 * self.index]
+
+    @property
+    def top(self):
+        return self.store.grid.boxes[4 * self.index + 1]
+
+    @property
+    def right(self):
+        return self.store.grid.boxes[4 * self.index + 2]
+
+    @property
+    def bottom(self):
+        return self.store.grid.boxes[4 * self.index + 3]
+
+    @property
+    def text(self):
+        return self.store.strings[self.store.text[self.index]]
+
+    @property
+    def hyperlink(self):
+        return self.store.strings[self.store.link[self.index]]
+
+    @property
+    def attr(self):
+        return self.store.attr[self.index]
+
+    @property
+    def size(self):
+        return self.store.size[self.index]
+
+    @property
+    def color(self):
+        return self.store.colors[self.store.color[self.index]]
+
+    @property
+    def ff(self):
+        return self.store.ff[self.index]
+
+    def isLink(self):
+        return not (self.hyperlink == "")
+
+    def key(self):
+        return self.store.key(self.index)
+
+    def record(self):
+        """Return everything needed to recreate this word, for `layoutcache'."""
+        return (self.text, self.hyperlink, self.left, self.bottom, self.attr,
+                self.size, self.color, self.ff)
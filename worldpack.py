@@ -0,0 +1,111 @@
+"""Bundles of laid out pages, for playing without a network.
+
+A bundle is written by `buildworld' and holds pages packed as by
+`layoutcache.pack', with an index by url at the end. `World' reads a bundle
+through a memory map; once one is opened with `openWorld', `getSource'
+serves the pages in it without fetching or parsing anything, and picks
+random pages from it too.
+"""
+# Copyright 2013 Aaron Graham-Horowitz
+#
+# This file is part of Escape from Wikipedia.
+#
+# Escape from Wikipedia is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or any later version.
+#
+# Escape from Wikipedia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import mmap, random, struct, zlib
+from constants import *
+import layoutcache
+from httpcache import isVolatile
+
+MAGIC = 'EFWW'
+VERSION = 1
+HEADER = struct.Struct('<4sHIQ')    # magic, version, pages, index offset
+ENTRY = struct.Struct('<QII')       # page offset, page length, url length
+
+WORLD = None    # The `World' pages are served from, if any
+
+def canonical(url):
+    """Return `url' without any #fragment, as pages are indexed."""
+    return url.split('#', 1)[0]
+
+def write(path, pages):
+    """Write a bundle of `pages', a list of (url, packed layout)."""
+    with open(path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, 0, 0))   # Filled in at the end
+        index = []
+        for url, data in pages:
+            index.append((url, f.tell(), len(data)))
+            f.write(data)
+        index_at = f.tell()
+        for url, offset, length in index:
+            url = url.encode('utf-8')
+            f.write(ENTRY.pack(offset, length, len(url)))
+            f.write(url)
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, VERSION, len(index), index_at))
+
+
+class World:
+    """A bundle written by `write', read through a memory map.
+
+    Only the index is read up front; each page is unpacked when loaded.
+    """
+    def __init__(self, path, rng=None):
+        self.file = open(path, 'rb')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.rng = random.Random() if rng is None else rng
+        magic, version, n_pages, offset = HEADER.unpack_from(self.map)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('Not a current world pack')
+        self.index = {}     # url -> (offset, length)
+        self.urls = []      # In the order they were crawled
+        for _ in xrange(n_pages):
+            page_at, length, url_length = ENTRY.unpack_from(self.map, offset)
+            offset += ENTRY.size
+            url = self.map[offset:offset + url_length].decode('utf-8')
+            offset += url_length
+            self.index[url] = (page_at, length)
+            self.urls.append(url)
+
+    def __len__(self):
+        return len(self.urls)
+
+    def __contains__(self, url):
+        return canonical(url) in self.index
+
+    def load(self, url):
+        """Return (url, (title, records, lines)) for `url', or None.
+
+        A random page is picked for a url like Special:Random, and the url
+        returned is always that of the page in the bundle.
+        """
+        if isVolatile(url) and self.urls:
+            url = self.rng.choice(self.urls)
+        url = canonical(url)
+        if url not in self.index:
+            return None
+        offset, length = self.index[url]
+        try:
+            return url, layoutcache.unpack(self.map[offset:offset + length])
+        except (ValueError, struct.error, zlib.error):
+            return None     # Laid out by other code than this
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+
+def openWorld(path):
+    """Serve pages from the bundle at `path' from now on."""
+    global WORLD
+    WORLD = World(path)